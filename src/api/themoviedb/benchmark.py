@@ -0,0 +1,109 @@
+import argparse
+import resource
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+import sqlalchemy as sa
+
+from api.themoviedb.job import JobMetadata, TMDBJob, run_jobs
+from api.themoviedb.rate_limiter import RateLimiter
+from api.themoviedb.replay_server import ReplayServer
+from api.themoviedb.themoviedb import TMDBApi
+from util.config import no_op_update_bookmark
+from util.connection_factory import ConnectionFactory
+from util.logging import configure_logging, get_logger
+from util.table_copier import TableIngestorFactory
+
+configure_logging()
+log = get_logger(__name__)
+
+TABLES = ['themovie_db.movies', 'themovie_db.tv_shows']
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark TMDB ingestion against a local replay server and DuckDB')
+    parser.add_argument('--pages', type=int, default=100, help='discover pages served per endpoint')
+    parser.add_argument('--recordings-dir', help='directory with recorded discover_movie/ and discover_tv/ pages')
+    parser.add_argument('--latency-ms', type=float, default=50, help='latency added to every response')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with injected 429 responses')
+    parser.add_argument('--rate-limit', type=int, default=40, help='client side request budget per --rate-period')
+    parser.add_argument('--rate-period', type=float, default=10.0)
+    parser.add_argument('--max-workers', type=int, default=1)
+    parser.add_argument('--parallel-tables', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--enrich-details', action='store_true')
+    parser.add_argument('--db', help='DuckDB file, a temporary one is used by default')
+    return parser.parse_args(argv)
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    with (
+        tempfile.TemporaryDirectory() as temp_dir,
+        ReplayServer(
+            recordings_dir=args.recordings_dir,
+            total_pages=args.pages,
+            latency_ms=args.latency_ms,
+            rate_limit_ratio=args.rate_limit_ratio,
+            retry_after=args.retry_after,
+        ) as server,
+    ):
+        conn = ConnectionFactory.from_uri(f'duckdb://{args.db or f"{temp_dir}/benchmark.duckdb"}')
+        rate_limiter = RateLimiter(args.rate_limit, args.rate_period)
+        tmdb_api = TMDBApi('benchmark', temp_dir, max_workers=args.max_workers, rate_limiter=rate_limiter, base_url=server.base_url)
+        started_at = time.perf_counter()
+
+        with tmdb_api, conn.get_sqlalchemy_engine() as engine:
+            with engine.begin() as db:
+                db.execute(sa.text('CREATE SCHEMA IF NOT EXISTS themovie_db'))
+            jobs = [
+                TMDBJob(
+                    metadata=JobMetadata(table_name=table, is_active=True, primary_keys=['id']),
+                    tmdb_api=tmdb_api,
+                    table_ingestor=TableIngestorFactory.from_connection_type(
+                        conn_type=conn.type,
+                        engine=engine,
+                        table=table,
+                        load_timestamp=datetime.now(UTC),
+                        primary_keys=['id'],
+                        range_column='id',
+                    ),
+                    temp_dir=temp_dir,
+                    bookmark=datetime(2000, 1, 1, tzinfo=UTC),
+                    update_bookmark=no_op_update_bookmark,
+                    streaming=args.streaming,
+                    max_pages=None,
+                    enrich_details=args.enrich_details,
+                )
+                for table in TABLES
+            ]
+            run_jobs(jobs, args.parallel_tables)
+
+            elapsed = time.perf_counter() - started_at
+            with engine.connect() as db:
+                rows = sum(db.execute(sa.text(f'SELECT count(*) FROM {table}')).scalar() for table in TABLES)
+
+        return {
+            'elapsed_seconds': round(elapsed, 2),
+            'pages': server.served_pages,
+            'rows': rows,
+            'pages_per_second': round(server.served_pages / elapsed, 1),
+            'rows_per_second': round(rows / elapsed, 1),
+            'requests': server.served_requests,
+            'rate_limited_requests': server.rate_limited_requests,
+            'rate_limit_sleep_seconds': round(rate_limiter.slept_seconds, 2),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    log.info('Benchmark args: %s', vars(args))
+    for key, value in run_benchmark(args).items():
+        log.info(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+import shutil
+
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+
+class PageCheckpoint:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def load_page(self, page: int) -> dict | None:
+        page_path = self._page_path(page)
+        if not os.path.exists(page_path):
+            return None
+        with open(page_path) as file:
+            return json.load(file)
+
+    def save_page(self, page: int, data: dict) -> None:
+        page_path = self._page_path(page)
+        # Write-then-rename so an interrupted run never leaves a truncated page behind
+        with open(f'{page_path}.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(f'{page_path}.tmp', page_path)
+
+    def completed_pages(self) -> list[int]:
+        return sorted(int(name[5:-5]) for name in os.listdir(self.path) if name.startswith('page-') and name.endswith('.json'))
+
+    def _page_path(self, page: int) -> str:
+        return f'{self.path}/page-{page:05d}.json'
+
+
+class CheckpointStore:
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+
+    def for_query(self, endpoint: str, params: dict) -> PageCheckpoint:
+        checkpoint = PageCheckpoint(f'{self.checkpoint_dir}/{_endpoint_prefix(endpoint)}{_params_key(params)}')
+        completed_pages = checkpoint.completed_pages()
+        if completed_pages:
+            log.info(f'Resuming {endpoint} from checkpoint with {len(completed_pages)} completed pages, last page {completed_pages[-1]}')
+        return checkpoint
+
+    def clear(self, endpoint: str) -> None:
+        if not os.path.isdir(self.checkpoint_dir):
+            return
+        for name in os.listdir(self.checkpoint_dir):
+            if name.startswith(_endpoint_prefix(endpoint)):
+                shutil.rmtree(f'{self.checkpoint_dir}/{name}')
+                log.info(f'Removed checkpoint {name}')
+
+
+def _endpoint_prefix(endpoint: str) -> str:
+    return endpoint.replace('/', '_') + '-'
+
+
+def _params_key(params: dict) -> str:
+    query = {key: value for key, value in params.items() if key != 'page'}
+    return hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()[:16]
@@ -0,0 +1,129 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+
+import polars as pl
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+from api.themoviedb.themoviedb import MOVIE_DETAILS_ENDPOINT, TV_SHOW_DETAILS_ENDPOINT, TMDBApi
+from util.connection_factory import read_arrow
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+TOP_CAST_SIZE = 10
+
+
+@dataclass
+class DetailSpec:
+    endpoint_template: str
+    schema: dict[str, pl.DataType]
+    mapper: Callable[[dict], dict]
+    # Summary columns that, when unchanged, let us reuse the details already stored in the destination table
+    change_columns: list[str]
+
+
+def _cast_names(detail: dict) -> str | None:
+    cast = detail.get('credits', {}).get('cast', [])
+    return ','.join(member['name'] for member in cast[:TOP_CAST_SIZE]) or None
+
+
+def map_movie_details(detail: dict) -> dict:
+    crew = detail.get('credits', {}).get('crew', [])
+    return {
+        'id': detail['id'],
+        'runtime': detail.get('runtime'),
+        'budget': detail.get('budget'),
+        'revenue': detail.get('revenue'),
+        'status': detail.get('status'),
+        'imdb_id': detail.get('imdb_id'),
+        'top_cast': _cast_names(detail),
+        'directors': ','.join(member['name'] for member in crew if member.get('job') == 'Director') or None,
+    }
+
+
+def map_tv_show_details(detail: dict) -> dict:
+    episode_run_time = detail.get('episode_run_time') or []
+    return {
+        'id': detail['id'],
+        'number_of_seasons': detail.get('number_of_seasons'),
+        'number_of_episodes': detail.get('number_of_episodes'),
+        'episode_run_time': episode_run_time[0] if episode_run_time else None,
+        'status': detail.get('status'),
+        'top_cast': _cast_names(detail),
+        'creators': ','.join(creator['name'] for creator in detail.get('created_by', [])) or None,
+    }
+
+
+MOVIE_DETAILS = DetailSpec(
+    endpoint_template=MOVIE_DETAILS_ENDPOINT,
+    schema={
+        'id': pl.Int64,
+        'runtime': pl.Int64,
+        'budget': pl.Int64,
+        'revenue': pl.Int64,
+        'status': pl.Utf8,
+        'imdb_id': pl.Utf8,
+        'top_cast': pl.Utf8,
+        'directors': pl.Utf8,
+    },
+    mapper=map_movie_details,
+    change_columns=['title', 'release_date', 'vote_count'],
+)
+
+TV_SHOW_DETAILS = DetailSpec(
+    endpoint_template=TV_SHOW_DETAILS_ENDPOINT,
+    schema={
+        'id': pl.Int64,
+        'number_of_seasons': pl.Int64,
+        'number_of_episodes': pl.Int64,
+        'episode_run_time': pl.Int64,
+        'status': pl.Utf8,
+        'top_cast': pl.Utf8,
+        'creators': pl.Utf8,
+    },
+    mapper=map_tv_show_details,
+    change_columns=['name', 'first_air_date', 'vote_count'],
+)
+
+
+class DetailEnricher:
+    def __init__(self, tmdb_api: TMDBApi, engine: Engine, table: str, spec: DetailSpec):
+        self.tmdb_api = tmdb_api
+        self.engine = engine
+        self.table = table
+        self.spec = spec
+
+    def __call__(self, df: pl.DataFrame) -> pl.DataFrame:
+        if df.is_empty():
+            return df
+        summaries = df.select('id', *self.spec.change_columns).unique('id', keep='last')
+        reused = self._reusable_details(summaries)
+        to_fetch = summaries.join(reused, on='id', how='anti')['id'].to_list()
+        log.info(f'Enriching {summaries.height} ids: {reused.height} reused from {self.table}, {len(to_fetch)} fetched')
+        fetched = pl.DataFrame(
+            [self.spec.mapper(detail) for detail in self.tmdb_api.fetch_details(self.spec.endpoint_template, to_fetch)],
+            schema=self.spec.schema,
+        )
+        return df.join(pl.concat([reused, fetched]), on='id', how='left')
+
+    def _reusable_details(self, summaries: pl.DataFrame) -> pl.DataFrame:
+        stored_columns = self._stored_columns()
+        detail_columns = [column for column in self.spec.schema if column != 'id']
+        if not set(self.spec.schema) | set(self.spec.change_columns) <= stored_columns:
+            return pl.DataFrame(schema=self.spec.schema)
+
+        ids = ', '.join(str(item_id) for item_id in summaries['id'].to_list())
+        columns = ', '.join(f'"{column}"' for column in ['id', *self.spec.change_columns, *detail_columns])
+        query = f'SELECT {columns} FROM {self.table} WHERE "id" IN ({ids})'
+        stored = read_arrow(self.engine, query)
+        stored = stored.filter(pl.any_horizontal(pl.col(detail_columns).is_not_null())).cast(self.spec.schema, strict=False)
+        unchanged = stored.join(summaries.cast(stored.select(summaries.columns).schema, strict=False), on=summaries.columns, how='semi')
+        return unchanged.select(list(self.spec.schema))
+
+    def _stored_columns(self) -> set[str]:
+        schema, _, table_name = self.table.rpartition('.')
+        inspector = inspect(self.engine)
+        if not inspector.has_table(table_name, schema=schema or None):
+            return set()
+        return {column['name'] for column in inspector.get_columns(table_name, schema=schema or None)}
@@ -1,27 +1,40 @@
 import os
 import shutil
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
-from typing import Callable
 
 import polars as pl
 from pydantic import AnyUrl, BaseModel
 
-from api.themoviedb.themoviedb import TMDBApi
+from api.themoviedb.checkpoint import CheckpointStore
+from api.themoviedb.enrichment import MOVIE_DETAILS, TV_SHOW_DETAILS, DetailEnricher, DetailSpec
+from api.themoviedb.response_cache import ResponseCache
+from api.themoviedb.themoviedb import MOVIES_ENDPOINT, TV_SHOWS_ENDPOINT, TMDBApi
 from util.config import ConfigFactory, UpdateBookmark
 from util.connection_factory import ConnectionFactory
+from util.dump_writer import DEFAULT_ROW_GROUP_SIZE, DumpWriter, DumpWriterFactory
+from util.file_system import DataFrameFormat
 from util.local_env import CONFIG_URI, TEMP_PATH
 from util.logging import configure_logging, get_logger
+from util.metadata import LoadType
 from util.secret_manager import SecretManager
-from util.table_copier import TableIngestor, TableIngestorFactory
+from util.table_copier import PostgresCopyMode, TableIngestor, TableIngestorFactory
 
 configure_logging()
 log = get_logger(__name__)
 
+DataFrameProcessor = Callable[[pl.DataFrame], pl.DataFrame]
+
 
 class JobMetadata(BaseModel):
     table_name: str
     is_active: bool
     primary_keys: list[str]
+    load_type: str = LoadType.INCREMENTAL
 
 
 class JobConfig(BaseModel):
@@ -30,19 +43,81 @@ class JobConfig(BaseModel):
     range_column: str
     bookmark: datetime
     metadata: list[JobMetadata]
+    max_workers: int = 1
+    http_pool_size: int | None = None
+    streaming: bool = False
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE
+    checkpoint_enabled: bool = True
+    max_pages: int | None = 10
+    sharded: bool = False
+    response_cache_ttl_seconds: int | None = None
+    response_cache_max_mb: int = 256
+    enrich_details: bool = False
+    max_parallel_tables: int = 1
+    postgres_copy_mode: str = PostgresCopyMode.SERVER_FILE
+    postgres_load_parallelism: int = 1
+    index_range_column: bool = False
+    stamp_batch_id: bool = False
+    merge_batch_size: int | None = None
+    detect_changes: bool = False
+
+
+# Declared up front so pages are built column by column without inference, and a page where a column happens to be all
+# null still gets the same type as every other page. Fields TMDB adds later are ignored until they are declared here.
+MOVIES_SCHEMA = pl.Schema(
+    {
+        'adult': pl.Boolean,
+        'backdrop_path': pl.Utf8,
+        'genre_ids': pl.List(pl.Int64),
+        'id': pl.Int64,
+        'original_language': pl.Utf8,
+        'original_title': pl.Utf8,
+        'overview': pl.Utf8,
+        'popularity': pl.Float64,
+        'poster_path': pl.Utf8,
+        'release_date': pl.Utf8,
+        'title': pl.Utf8,
+        'video': pl.Boolean,
+        'vote_average': pl.Float64,
+        'vote_count': pl.Int64,
+    }
+)
+
+TV_SHOWS_SCHEMA = pl.Schema(
+    {
+        'adult': pl.Boolean,
+        'backdrop_path': pl.Utf8,
+        'genre_ids': pl.List(pl.Int64),
+        'id': pl.Int64,
+        'origin_country': pl.List(pl.Utf8),
+        'original_language': pl.Utf8,
+        'original_name': pl.Utf8,
+        'overview': pl.Utf8,
+        'popularity': pl.Float64,
+        'poster_path': pl.Utf8,
+        'first_air_date': pl.Utf8,
+        'name': pl.Utf8,
+        'vote_average': pl.Float64,
+        'vote_count': pl.Int64,
+    }
+)
+
+
+def _join_list(column: str) -> pl.Expr:
+    return pl.col(column).list.eval(pl.element().cast(pl.Utf8)).list.join(',')
+
+
+def _to_date(column: str) -> pl.Expr:
+    # TMDB sends an empty string for unknown dates
+    return pl.col(column).str.to_date('%Y-%m-%d', strict=False)
 
 
 def transform_movies(df: pl.DataFrame) -> pl.DataFrame:
-    df = df.with_columns(pl.col('genre_ids').list.eval(pl.element().cast(pl.Utf8)).list.join(','))
-    df = df.with_columns([pl.col('release_date').cast(pl.Date)])
-    return df
+    return df.lazy().with_columns(_join_list('genre_ids'), _to_date('release_date')).collect()
 
 
 def transform_tv_show(df: pl.DataFrame) -> pl.DataFrame:
-    df = df.with_columns(pl.col('origin_country').list.eval(pl.element().cast(pl.Utf8)).list.join(','))
-    df = df.with_columns(pl.col('genre_ids').list.eval(pl.element().cast(pl.Utf8)).list.join(','))
-    df = df.with_columns([pl.col('first_air_date').cast(pl.Date)])
-    return df
+    return df.lazy().with_columns(_join_list('origin_country'), _join_list('genre_ids'), _to_date('first_air_date')).collect()
 
 
 class TMDBJob:
@@ -54,6 +129,11 @@ class TMDBJob:
         temp_dir: str,
         bookmark: datetime,
         update_bookmark: UpdateBookmark,
+        streaming: bool = False,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        max_pages: int | None = 10,
+        sharded: bool = False,
+        enrich_details: bool = False,
     ):
         self.metadata = metadata
         self.tmdb_api = tmdb_api
@@ -62,35 +142,114 @@ class TMDBJob:
         self.temp_dir = temp_dir
         self.bookmark = bookmark
         self.update_bookmark = update_bookmark
+        self.streaming = streaming
+        self.row_group_size = row_group_size
+        self.max_pages = max_pages
+        self.sharded = sharded
+        self.enrich_details = enrich_details
 
     def run(self):
         log.info(f'Starting job for {self.metadata.table_name}')
         if self.metadata.table_name == 'themovie_db.movies':
-            movies_data = self.tmdb_api.fetch_movies(self.bookmark, start_page=1, max_pages=10)
-            self._save_data(movies_data, transform_movies)
+            processor = self._processor(transform_movies, MOVIE_DETAILS)
+            if self.streaming:
+                self._save_pages(self.tmdb_api.iter_movies(self.bookmark, self.max_pages, sharded=self.sharded), MOVIES_SCHEMA, processor)
+            else:
+                movies_data = self.tmdb_api.fetch_movies(self.bookmark, self.max_pages, sharded=self.sharded)
+                self._save_data(movies_data, MOVIES_SCHEMA, processor)
+            self.tmdb_api.clear_checkpoint(MOVIES_ENDPOINT)
         elif self.metadata.table_name == 'themovie_db.tv_shows':
-            tv_shows_data = self.tmdb_api.fetch_tv_shows(self.bookmark, start_page=1, max_pages=10)
-            self._save_data(tv_shows_data, transform_tv_show)
+            processor = self._processor(transform_tv_show, TV_SHOW_DETAILS)
+            if self.streaming:
+                self._save_pages(
+                    self.tmdb_api.iter_tv_shows(self.bookmark, self.max_pages, sharded=self.sharded), TV_SHOWS_SCHEMA, processor
+                )
+            else:
+                tv_shows_data = self.tmdb_api.fetch_tv_shows(self.bookmark, self.max_pages, sharded=self.sharded)
+                self._save_data(tv_shows_data, TV_SHOWS_SCHEMA, processor)
+            self.tmdb_api.clear_checkpoint(TV_SHOWS_ENDPOINT)
         else:
             log.error(f'Unsupported table name: {self.metadata.table_name}')
             return
 
-    def _save_data(self, data, custom_processor: Callable[[pl.DataFrame], pl.DataFrame] | None = None):
-        df = pl.DataFrame(data)
+    def _processor(self, transform: DataFrameProcessor, detail_spec: DetailSpec) -> DataFrameProcessor:
+        if not self.enrich_details:
+            return transform
+        enricher = DetailEnricher(self.tmdb_api, self.table_ingestor.engine, self.metadata.table_name, detail_spec)
+        return lambda df: enricher(transform(df))
+
+    def _save_data(self, data, schema: pl.Schema, custom_processor: DataFrameProcessor | None = None):
+        df = pl.from_dicts(data, schema=schema)
         log.info(f'Fetched {df.height} movies')
+        if df.is_empty():
+            log.info('No data to ingest')
+            return
         if custom_processor:
             df = custom_processor(df)
-        dump_path = f'{self.temp_dir}/{self.metadata.table_name.replace(".", "_")}.csv'
-        df.write_csv(dump_path, separator='|', null_value=None)
+        with self._create_dump_writer() as writer:
+            writer.write(df)
         self._create_temp_table(df)
-        self.table_ingestor.execute(dump_path)
+        self.table_ingestor.execute(writer.dump_path)
+        self.update_bookmark(self.utc_now)
+
+    def _save_pages(self, pages: Iterable[list[dict]], schema: pl.Schema, custom_processor: DataFrameProcessor | None = None):
+        with self._create_dump_writer() as writer:
+            for page in pages:
+                df = pl.from_dicts(page, schema=schema)
+                if custom_processor:
+                    df = custom_processor(df)
+                if not writer.rows:
+                    self._create_temp_table(df)
+                writer.write(df)
+        log.info(f'Fetched {writer.rows} rows')
+        if not writer.rows:
+            log.info('No data to ingest')
+            return
+        self.table_ingestor.execute(writer.dump_path)
         self.update_bookmark(self.utc_now)
 
+    def _create_dump_writer(self) -> DumpWriter:
+        dump_format = self.table_ingestor.dump_format
+        dump_path = f'{self.temp_dir}/{self.metadata.table_name.replace(".", "_")}'
+        if dump_format == DataFrameFormat.CSV:
+            dump_path += '.csv'
+        return DumpWriterFactory.from_format(dump_format, dump_path, self.row_group_size)
+
     def _create_temp_table(self, df: pl.DataFrame):
         log.info(f'Creating temporary table {self.table_ingestor.temp_table}')
-        df = df.remove()
-        with self.table_ingestor.engine.connect() as conn:
-            df.write_database(self.table_ingestor.temp_table, connection=conn, if_table_exists='replace')
+        self.table_ingestor.create_temp_table(df.remove())
+
+
+def run_jobs(jobs: list[TMDBJob], max_parallel_tables: int = 1) -> dict[str, float]:
+    # Tables only share the TMDB client, and with it the rate limiter, so the API fetch of one table overlaps the merge of another
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_parallel_tables, thread_name_prefix='tmdb-job') as executor:
+        timings = dict(executor.map(_run_timed, jobs))
+    elapsed = time.perf_counter() - started_at
+    if timings:
+        log.info(
+            f'Finished {len(timings)} TMDB jobs in {elapsed:.1f}s, '
+            f'{sum(timings.values()) / elapsed:.2f}x speedup over running them back to back'
+        )
+    return timings
+
+
+def _run_timed(job: TMDBJob) -> tuple[str, float]:
+    started_at = time.perf_counter()
+    job.run()
+    elapsed = time.perf_counter() - started_at
+    log.info(f'Finished job for {job.metadata.table_name} in {elapsed:.1f}s')
+    return job.metadata.table_name, elapsed
+
+
+def _synchronized(update_bookmark: UpdateBookmark) -> UpdateBookmark:
+    lock = threading.Lock()
+
+    def update(bookmark: datetime) -> None:
+        with lock:
+            update_bookmark(bookmark)
+
+    return update
 
 
 def main(config_uri: str = f'{CONFIG_URI}/tmdb_config.json'):
@@ -98,19 +257,41 @@ def main(config_uri: str = f'{CONFIG_URI}/tmdb_config.json'):
     config = config_repo.get(JobConfig)
     secret_manager = SecretManager()
     temp_dir = f'{TEMP_PATH}/themoviedb'
-    conn = ConnectionFactory.from_uri(str(config.db_uri))
+    # Kept outside temp_dir so checkpoints are only removed per table, once its data has been ingested
+    checkpoint_store = CheckpointStore(f'{TEMP_PATH}/themoviedb_checkpoints') if config.checkpoint_enabled else None
+    response_cache = None
+    if config.response_cache_ttl_seconds:
+        response_cache = ResponseCache(
+            f'{TEMP_PATH}/themoviedb_http_cache',
+            ttl_seconds=config.response_cache_ttl_seconds,
+            max_bytes=config.response_cache_max_mb * 1024 * 1024,
+        )
+    # Every table running in parallel holds one connection for its merge plus one per COPY shard
+    pool_size = config.max_parallel_tables * (config.postgres_load_parallelism + 1)
+    conn = ConnectionFactory.from_uri(str(config.db_uri), pool_size=pool_size)
+    batch_id = uuid.uuid4().hex if config.stamp_batch_id else None
 
     if not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
 
-    tmdb_api = TMDBApi(secret_manager.get_secret('themoviedb_api').get('token'), temp_dir)
-
-    for metadata in config.metadata:
-        if not metadata.is_active:
-            log.info(f'Skipping inactive job for {metadata.table_name}')
-            continue
+    with (
+        TMDBApi(
+            secret_manager.get_secret('themoviedb_api').get('token'),
+            temp_dir,
+            max_workers=config.max_workers,
+            pool_size=config.http_pool_size,
+            checkpoint_store=checkpoint_store,
+            response_cache=response_cache,
+        ) as tmdb_api,
+        conn.get_sqlalchemy_engine() as engine,
+    ):
+        update_bookmark = _synchronized(config_repo.update)
+        jobs = []
+        for metadata in config.metadata:
+            if not metadata.is_active:
+                log.info(f'Skipping inactive job for {metadata.table_name}')
+                continue
 
-        with conn.get_sqlalchemy_engine() as engine:
             table_ingestor = TableIngestorFactory.from_connection_type(
                 conn_type=conn.type,
                 engine=engine,
@@ -118,16 +299,32 @@ def main(config_uri: str = f'{CONFIG_URI}/tmdb_config.json'):
                 load_timestamp=datetime.now(UTC),
                 primary_keys=metadata.primary_keys,
                 range_column=config.range_column,
+                index_range_column=config.index_range_column,
+                batch_id=batch_id,
+                merge_batch_size=config.merge_batch_size,
+                detect_changes=config.detect_changes,
+                load_type=metadata.load_type,
+                copy_mode=config.postgres_copy_mode,
+                load_parallelism=config.postgres_load_parallelism,
+            )
+
+            jobs.append(
+                TMDBJob(
+                    metadata=metadata,
+                    tmdb_api=tmdb_api,
+                    table_ingestor=table_ingestor,
+                    temp_dir=temp_dir,
+                    bookmark=config.bookmark,
+                    update_bookmark=update_bookmark,
+                    streaming=config.streaming,
+                    row_group_size=config.row_group_size,
+                    max_pages=config.max_pages,
+                    sharded=config.sharded,
+                    enrich_details=config.enrich_details,
+                )
             )
 
-            TMDBJob(
-                metadata=metadata,
-                tmdb_api=tmdb_api,
-                table_ingestor=table_ingestor,
-                temp_dir=temp_dir,
-                bookmark=config.bookmark,
-                update_bookmark=config_repo.update,
-            ).run()
+        run_jobs(jobs, config.max_parallel_tables)
 
     if os.path.isdir(temp_dir):
         shutil.rmtree(temp_dir)
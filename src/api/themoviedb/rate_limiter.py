@@ -0,0 +1,86 @@
+import threading
+import time
+from collections.abc import Callable, Mapping
+from email.utils import parsedate_to_datetime
+
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_RETRY_AFTER = 10
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        max_requests: int = 40,
+        per_seconds: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.capacity = max_requests
+        self.refill_rate = max_requests / per_seconds
+        self.slept_seconds = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(max_requests)
+        self._updated_at = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0 and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                if wait <= 0:
+                    wait = (1 - self._tokens) / self.refill_rate
+                self.slept_seconds += wait
+            self._sleep(wait)
+
+    def block_for(self, seconds: float) -> None:
+        with self._lock:
+            now = self._clock()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = now
+        log.info(f'Rate limit hit. Pausing all requests for {seconds} seconds...')
+
+    def throttle(self, headers: Mapping[str, str]) -> None:
+        # A 429 always pauses every worker, for DEFAULT_RETRY_AFTER seconds when the response doesn't say how long
+        self.block_for(_parse_retry_after(headers.get('Retry-After')))
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        if 'Retry-After' in headers:
+            self.block_for(_parse_retry_after(headers['Retry-After']))
+            return
+
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        with self._lock:
+            self._tokens = min(self._tokens, float(remaining))
+        reset = headers.get('X-RateLimit-Reset')
+        if float(remaining) < 1 and reset:
+            self.block_for(max(float(reset) - time.time(), 0))
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+
+def _parse_retry_after(value: str | None) -> float:
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
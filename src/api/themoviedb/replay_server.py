@@ -0,0 +1,154 @@
+import glob
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+PAGE_SIZE = 20
+DETAILS_PATH = re.compile(r'^/3/(movie|tv)/(\d+)$')
+DISCOVER_PATH = re.compile(r'^/3/discover/(movie|tv)$')
+
+
+class ReplayServer:
+    # Recorded pages are read from `{recordings_dir}/discover_movie*/page-00001.json`, which also matches the
+    # `discover_movie-<params hash>/` directories of a TMDB checkpoint, so a checkpoint directory can be replayed as it is.
+    # The first matching directory in name order wins. Anything not recorded is generated deterministically.
+    def __init__(
+        self,
+        recordings_dir: str | None = None,
+        total_pages: int = 500,
+        latency_ms: float = 0,
+        rate_limit_ratio: float = 0,
+        retry_after: int = 1,
+        seed: int = 42,
+    ):
+        self.recordings_dir = recordings_dir
+        self.total_pages = total_pages
+        self.latency_ms = latency_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.served_requests = 0
+        self.served_pages = 0
+        self.rate_limited_requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='tmdb-replay', daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/3'
+
+    def __enter__(self) -> 'ReplayServer':
+        self._thread.start()
+        log.info(f'TMDB replay server listening on {self.base_url}')
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, path: str, query: dict[str, str]) -> tuple[int, dict, dict[str, str]]:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.served_requests += 1
+            if self._random.random() < self.rate_limit_ratio:
+                self.rate_limited_requests += 1
+                return HTTPStatus.TOO_MANY_REQUESTS, {'status_code': 25}, {'Retry-After': str(self.retry_after)}
+
+        if match := DISCOVER_PATH.match(path):
+            with self._lock:
+                self.served_pages += 1
+            return HTTPStatus.OK, self._discover_page(match.group(1), int(query.get('page', 1))), {}
+        if match := DETAILS_PATH.match(path):
+            return HTTPStatus.OK, _generate_details(match.group(1), int(match.group(2))), {}
+        return HTTPStatus.NOT_FOUND, {'status_code': 34, 'status_message': 'The resource you requested could not be found.'}, {}
+
+    def _discover_page(self, kind: str, page: int) -> dict:
+        recorded_pages = sorted(glob.glob(f'{self.recordings_dir}/discover_{kind}*/page-{page:05d}.json')) if self.recordings_dir else []
+        if recorded_pages:
+            with open(recorded_pages[0]) as file:
+                return json.load(file)
+        results = [_generate_result(kind, page * PAGE_SIZE + i) for i in range(PAGE_SIZE)] if page <= self.total_pages else []
+        return {'page': page, 'results': results, 'total_pages': self.total_pages, 'total_results': self.total_pages * PAGE_SIZE}
+
+    def _handler_class(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:  # noqa: N802
+                url = urlparse(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, payload, headers = server.respond(url.path, query)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args) -> None:
+                pass
+
+        return Handler
+
+
+def _generate_result(kind: str, item_id: int) -> dict:
+    day = str(date(2000, 1, 1) + timedelta(days=item_id % 9000))
+    result = {
+        'adult': False,
+        'backdrop_path': f'/{item_id}.jpg' if item_id % 3 else None,
+        'genre_ids': [item_id % 7 + 10, item_id % 5 + 20],
+        'id': item_id,
+        'original_language': 'en',
+        'overview': f'Overview of {kind} {item_id}',
+        'popularity': item_id % 1000 / 10,
+        'poster_path': f'/{item_id}-poster.jpg',
+        'vote_average': item_id % 100 / 10,
+        'vote_count': item_id % 5000,
+    }
+    if kind == 'movie':
+        return result | {'original_title': f'Movie {item_id}', 'title': f'Movie {item_id}', 'release_date': day, 'video': False}
+    return result | {'origin_country': ['US'], 'original_name': f'Show {item_id}', 'name': f'Show {item_id}', 'first_air_date': day}
+
+
+def _generate_details(kind: str, item_id: int) -> dict:
+    cast_and_crew = {
+        'cast': [{'name': f'Actor {item_id}-{i}'} for i in range(3)],
+        'crew': [{'name': f'Director {item_id}', 'job': 'Director'}],
+    }
+    if kind == 'movie':
+        return {
+            'id': item_id,
+            'runtime': 90 + item_id % 60,
+            'budget': item_id * 1000,
+            'revenue': item_id * 2000,
+            'status': 'Released',
+            'imdb_id': f'tt{item_id:07d}',
+            'credits': cast_and_crew,
+        }
+    return {
+        'id': item_id,
+        'number_of_seasons': item_id % 5 + 1,
+        'number_of_episodes': item_id % 50 + 1,
+        'episode_run_time': [45],
+        'status': 'Returning Series',
+        'created_by': [{'name': f'Creator {item_id}'}],
+        'credits': cast_and_crew,
+    }
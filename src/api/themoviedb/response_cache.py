@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass
+class CachedResponse:
+    body: dict
+    etag: str | None
+    stored_at: float
+    fresh: bool
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl_seconds: float = 3600,
+        max_bytes: int = 256 * 1024 * 1024,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = sum(os.path.getsize(path) for path in self._entry_paths())
+
+    def lookup(self, endpoint: str, params: dict) -> CachedResponse | None:
+        path = self._entry_path(endpoint, params)
+        with self._lock:
+            try:
+                with open(path) as file:
+                    entry = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return None
+            now = self._clock()
+            fresh = now - entry['stored_at'] < self.ttl_seconds
+            if fresh:
+                self.hits += 1
+                # The access time drives LRU eviction, stored_at drives the TTL
+                os.utime(path, (now, now))
+        return CachedResponse(body=entry['body'], etag=entry['etag'], stored_at=entry['stored_at'], fresh=fresh)
+
+    def store(self, endpoint: str, params: dict, body: dict, etag: str | None) -> None:
+        with self._lock:
+            self.misses += 1
+            self._write(self._entry_path(endpoint, params), body, etag)
+            self._evict()
+
+    def refresh(self, endpoint: str, params: dict, cached: CachedResponse) -> None:
+        with self._lock:
+            self.revalidated += 1
+            self._write(self._entry_path(endpoint, params), cached.body, cached.etag)
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses, 'size_bytes': self._size}
+
+    def _write(self, path: str, body: dict, etag: str | None) -> None:
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'etag': etag, 'stored_at': self._clock(), 'body': body}, file)
+        os.replace(f'{path}.tmp', path)
+        now = self._clock()
+        os.utime(path, (now, now))
+        self._size += os.path.getsize(path) - previous_size
+
+    def _evict(self) -> None:
+        if self._size <= self.max_bytes:
+            return
+        for path in sorted(self._entry_paths(), key=os.path.getmtime):
+            self._size -= os.path.getsize(path)
+            os.remove(path)
+            if self._size <= self.max_bytes:
+                break
+        log.info(f'Evicted least recently used responses, cache size is now {self._size} bytes')
+
+    def _entry_paths(self) -> list[str]:
+        return [f'{self.cache_dir}/{name}' for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+
+    def _entry_path(self, endpoint: str, params: dict) -> str:
+        key = json.dumps({'endpoint': endpoint, 'params': params}, sort_keys=True, default=str)
+        return f'{self.cache_dir}/{hashlib.sha256(key.encode()).hexdigest()}.json'
@@ -1,97 +1,351 @@
-import json
+import itertools
+import math
+import threading
 import time
-from datetime import datetime
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, date, datetime, timedelta
 from http import HTTPStatus
+from typing import TypeVar
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
 
+from api.themoviedb.checkpoint import CheckpointStore, PageCheckpoint
+from api.themoviedb.rate_limiter import RateLimiter
+from api.themoviedb.response_cache import ResponseCache
 from util.logging import get_logger
 
 log = get_logger(__name__)
 
+T = TypeVar('T')
+
 
 # https://developer.themoviedb.org/reference/
 
+MOVIES_ENDPOINT = 'discover/movie'
+TV_SHOWS_ENDPOINT = 'discover/tv'
+MOVIES_DATE_PARAMS = ('release_date.gte', 'release_date.lte')
+TV_SHOWS_DATE_PARAMS = ('air_date.gte', 'air_date.lte')
+MOVIE_DETAILS_ENDPOINT = 'movie/{id}'
+TV_SHOW_DETAILS_ENDPOINT = 'tv/{id}'
+
+# discover endpoints refuse to serve pages past 500, whatever total_pages says
+MAX_DISCOVER_PAGES = 500
+DISCOVER_PAGE_SIZE = 20
+
+MAX_RATE_LIMITED_ATTEMPTS = 5
+
+
+@dataclass
+class DateWindow:
+    start: date
+    end: date
+    params: dict
+    first_page: dict
+    checkpoint: PageCheckpoint | None
+
+    @property
+    def total_results(self) -> int:
+        return self.first_page.get('total_results', 0)
+
+    @property
+    def total_pages(self) -> int:
+        return self.first_page.get('total_pages', 0)
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
 
 class TMDBApi:
-    def __init__(self, api_key: str, temp_dir: str):
+    def __init__(
+        self,
+        api_key: str,
+        temp_dir: str,
+        max_workers: int = 1,
+        rate_limiter: RateLimiter | None = None,
+        pool_size: int | None = None,
+        max_retries: int = 3,
+        checkpoint_store: CheckpointStore | None = None,
+        response_cache: ResponseCache | None = None,
+        base_url: str = 'https://api.themoviedb.org/3',
+    ):
         self.api_key = api_key
         self.temp_dir = temp_dir
-        self.base_url = 'https://api.themoviedb.org/3'
-        self.headers = {'accept': 'application/json', 'Authorization': f'Bearer {self.api_key}'}
+        self.base_url = base_url
+        # accept_encoding=True advertises gzip, deflate and br (brotli is a dependency), plus zstd when zstandard is installed
+        self.headers = {'accept': 'application/json', 'Authorization': f'Bearer {self.api_key}'} | make_headers(accept_encoding=True)
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.checkpoint_store = checkpoint_store
+        self.response_cache = response_cache
+        self.session = self._create_session(pool_size or max(max_workers, 10), max_retries)
+        self.request_count = 0
+        self.request_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def __enter__(self) -> 'TMDBApi':
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.request_count:
+            log.info(
+                f'TMDB session closed after {self.request_count} requests, '
+                f'average latency {self.request_seconds / self.request_count * 1000:.1f} ms'
+            )
+        if self.response_cache:
+            log.info(f'TMDB response cache stats: {self.response_cache.stats()}')
+        self.session.close()
+
+    def _create_session(self, pool_size: int, max_retries: int) -> requests.Session:
+        # 429 is left out of the retry statuses on purpose: the shared rate limiter has to see it to pause every worker.
+        # urllib3 would otherwise still retry any 429 carrying Retry-After on its own, hence respect_retry_after_header=False.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=('GET',),
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(self.headers)
+        return session
 
     def fetch_api_data(self, endpoint: str, max_pages: int, params, start_page: int = 1) -> list[dict]:
+        return self._collect(endpoint, self.iter_api_pages(endpoint, max_pages, params, start_page))
+
+    def _collect(self, endpoint: str, pages: Iterable[list[dict]]) -> list[dict]:
         all_result: list[dict] = []
-        current_page = start_page
+        try:
+            for result in pages:
+                all_result.extend(result)
+        except Exception as e:
+            self._handle_error(e, endpoint)
+
+        return all_result
+
+    def iter_api_pages(self, endpoint: str, max_pages: int, params, start_page: int = 1) -> Iterator[list[dict]]:
         params = self._prepare_params(params, start_page)
         log.info('Fetching data from TMDB API with params: %s', params)
+        checkpoint = self.checkpoint_store.for_query(endpoint, params) if self.checkpoint_store else None
 
-        while True:
-            try:
-                data = self._make_api_request(endpoint, params)
-                result = data.get('results', [])
+        data = self._fetch_page(endpoint, params, start_page, checkpoint)
+        total_pages = data['total_pages']
+        if self.max_workers > 1:
+            pages = self._iter_pages_concurrently(endpoint, params, start_page, max_pages, total_pages, checkpoint)
+        else:
+            pages = self._iter_pages_sequentially(endpoint, params, start_page, checkpoint)
+        for page, page_data in itertools.chain([(start_page, data)], pages):
+            result = page_data.get('results', [])
+            if not result:
+                log.info(f'No results found on page {page}. Stopping pagination.')
+                break
 
-                if not result:
-                    log.info(f'No results found on page {current_page}. Stopping pagination.')
-                    break
+            log.info(f'Fetched page {page} with {len(result)} objects out of page {page_data["total_pages"]}')
+            yield result
 
-                all_result.extend(result)
-                log.info(f'Fetched page {current_page} with {len(result)} objects out of page {data["total_pages"]}')
+            if self._should_stop_pagination(page, max_pages, total_pages):
+                break
 
-                if self._should_stop_pagination(current_page, max_pages, data['total_pages']):
-                    break
+    def _iter_pages_sequentially(
+        self, endpoint: str, params: dict, start_page: int, checkpoint: PageCheckpoint | None
+    ) -> Iterator[tuple[int, dict]]:
+        for page in itertools.count(start_page + 1):
+            yield page, self._fetch_page(endpoint, params, page, checkpoint)
 
-                current_page += 1
-                params['page'] = current_page
-                time.sleep(0.25)  # Respect rate limits (40 requests per 10 seconds)
+    def _iter_pages_concurrently(
+        self, endpoint: str, params: dict, start_page: int, max_pages: int, total_pages: int, checkpoint: PageCheckpoint | None
+    ) -> Iterator[tuple[int, dict]]:
+        last_page = min(max_pages, total_pages) if max_pages else total_pages
+        pages = range(start_page + 1, last_page + 1)
+        yield from zip(pages, self._map_in_order(lambda page: self._fetch_page(endpoint, params, page, checkpoint), pages), strict=True)
 
-            except Exception as e:
-                log.error(f'Error occurred: {e}')
-                self._handle_error(e, all_result, endpoint)
+    def _map_in_order(self, fn: Callable[..., T], items: Iterable) -> Iterator[T]:
+        pending: deque[Future] = deque()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='tmdb')
+        try:
+            # Only a bounded window of requests is in flight, and results are yielded in submission order
+            for item in items:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= self.max_workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
-        return all_result
+    def iter_sharded_pages(self, endpoint: str, params: dict, date_params: tuple[str, str], start: date, end: date) -> Iterator[list[dict]]:
+        # Every page of every window is fetched: windows exist to get past the discover page cap, so max_pages doesn't apply
+        windows = self._plan_windows(endpoint, params, date_params, start, end)
+        log.info(f'Fetching {endpoint} from {start} to {end} in {len(windows)} date windows')
+        tasks = [(window, page) for window in windows for page in range(1, min(window.total_pages, MAX_DISCOVER_PAGES) + 1)]
+        seen_ids: set[int] = set()
+        pages = self._map_in_order(lambda task: self._fetch_window_page(endpoint, *task), tasks)
+        for (window, page), page_data in zip(tasks, pages, strict=True):
+            # Windows can overlap on ids (e.g. movies with several release dates), so keep the first occurrence only
+            result = [row for row in page_data.get('results', []) if row['id'] not in seen_ids]
+            seen_ids.update(row['id'] for row in result)
+            log.info(f'Fetched page {page} of window {window.start}..{window.end} with {len(result)} new objects')
+            if result:
+                yield result
+
+    def _plan_windows(self, endpoint: str, params: dict, date_params: tuple[str, str], start: date, end: date) -> list[DateWindow]:
+        windows: list[DateWindow] = []
+        candidates = [self._probe_window(endpoint, params, date_params, (start, end))]
+        while candidates:
+            oversized = [window for window in candidates if window.total_pages > MAX_DISCOVER_PAGES and window.days > 1]
+            windows.extend(window for window in candidates if window not in oversized)
+            ranges = [date_range for window in oversized for date_range in _split_window(window)]
+            candidates = list(self._map_in_order(lambda date_range: self._probe_window(endpoint, params, date_params, date_range), ranges))
+
+        for window in windows:
+            if window.total_pages > MAX_DISCOVER_PAGES:
+                log.warning(f'Window {window.start} has {window.total_results} results, pages past {MAX_DISCOVER_PAGES} are unreachable')
+        return sorted(windows, key=lambda window: window.start)
+
+    def _probe_window(self, endpoint: str, params: dict, date_params: tuple[str, str], date_range: tuple[date, date]) -> DateWindow:
+        start, end = date_range
+        window_params = {key: value for key, value in params.items() if key != 'page'} | {
+            date_params[0]: str(start),
+            date_params[1]: str(end),
+        }
+        checkpoint = self.checkpoint_store.for_query(endpoint, window_params) if self.checkpoint_store else None
+        first_page = self._fetch_page(endpoint, window_params, 1, checkpoint)
+        return DateWindow(start, end, window_params, first_page, checkpoint)
+
+    def _fetch_window_page(self, endpoint: str, window: DateWindow, page: int) -> dict:
+        if page == 1:
+            return window.first_page
+        return self._fetch_page(endpoint, window.params, page, window.checkpoint)
+
+    def _fetch_page(self, endpoint: str, params: dict, page: int, checkpoint: PageCheckpoint | None = None) -> dict:
+        data = checkpoint.load_page(page) if checkpoint else None
+        if data is None:
+            data = self._make_api_request(endpoint, params | {'page': page})
+            if checkpoint:
+                checkpoint.save_page(page, data)
+        return data
 
     @staticmethod
     def _prepare_params(params: dict | None, page: int) -> dict:
         return {'page': page} if params is None else params.update({'page': page}) or params
 
-    def _make_api_request(self, endpoint: str, params: dict) -> dict:
-        response = requests.get(f'{self.base_url}/{endpoint}', headers=self.headers, params=params)
+    def _make_api_request(self, endpoint: str, params: dict, missing_ok: bool = False) -> dict | None:
+        cached = self.response_cache.lookup(endpoint, params) if self.response_cache else None
+        if cached and cached.fresh:
+            return cached.body
+        headers = {'If-None-Match': cached.etag} if cached and cached.etag else None
+
+        for _ in range(MAX_RATE_LIMITED_ATTEMPTS):
+            response = self._get(endpoint, params, headers)
+            if response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+                self.rate_limiter.update_from_headers(response.headers)
+                break
+            self.rate_limiter.throttle(response.headers)
+        else:
+            raise Exception(f'Error fetching data: {endpoint} still rate limited after {MAX_RATE_LIMITED_ATTEMPTS} attempts')
 
-        if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
-            return self._handle_rate_limit(endpoint, params, int(response.headers.get('Retry-After')))
+        if response.status_code == HTTPStatus.NOT_FOUND and missing_ok:
+            log.info(f'{endpoint} not found, skipping')
+            return None
+
+        if response.status_code == HTTPStatus.NOT_MODIFIED and cached:
+            self.response_cache.refresh(endpoint, params, cached)
+            return cached.body
 
         if response.status_code != HTTPStatus.OK:
             raise Exception(f'Error fetching data: {response.status_code} - {response.text}')
 
-        return response.json()
+        data = response.json()
+        if self.response_cache:
+            self.response_cache.store(endpoint, params, data, response.headers.get('ETag'))
+        return data
+
+    def _get(self, endpoint: str, params: dict, headers: dict | None) -> requests.Response:
+        self.rate_limiter.acquire()
+        started_at = time.perf_counter()
+        response = self.session.get(f'{self.base_url}/{endpoint}', params=params, headers=headers)
+        elapsed = time.perf_counter() - started_at
+        self._record_latency(elapsed)
+        target = f'{endpoint} page {params["page"]}' if 'page' in params else endpoint
+        log.info(f'GET {target}: {response.status_code} in {elapsed * 1000:.1f} ms')
+        return response
+
+    def fetch_details(self, endpoint_template: str, ids: Iterable[int], append_to_response: str | None = 'credits') -> list[dict]:
+        params = {'append_to_response': append_to_response} if append_to_response else {}
+        details = self._map_in_order(lambda item_id: self._fetch_detail(endpoint_template.format(id=item_id), params), ids)
+        return [detail for detail in details if detail is not None]
+
+    def _fetch_detail(self, endpoint: str, params: dict) -> dict | None:
+        return self._make_api_request(endpoint, params, missing_ok=True)
 
-    def _handle_rate_limit(self, endpoint: str, params: dict, retry_after: int = 10) -> dict:
-        log.info(f'Rate limit hit. Waiting {retry_after} seconds...')
-        time.sleep(retry_after)
-        return self._make_api_request(endpoint, params)
+    def _record_latency(self, elapsed: float) -> None:
+        with self._stats_lock:
+            self.request_count += 1
+            self.request_seconds += elapsed
 
-    def _handle_error(self, e, results: list[dict], endpoint: str) -> None:
+    def _handle_error(self, e, endpoint: str) -> None:
         log.error(f'Error occurred: {e}')
-        self._save_temp_data(results, endpoint.replace('/', '_') + '_temp_data.parquet')
+        if self.checkpoint_store:
+            log.info(f'Fetched pages of {endpoint} are kept in {self.checkpoint_store.checkpoint_dir} for the next run')
         raise Exception(f'Failed to fetch data from TMDB API: {e}')
 
-    def _save_temp_data(self, data: list[dict], file_name: str) -> None:
-        file_path = f'{self.temp_dir}/{file_name}'
-        with open(file_path, 'w') as file:
-            json.dump(data, file, indent=4)
-        log.info(f'Saved {len(data)} records to temp file: {file_path}')
+    def clear_checkpoint(self, endpoint: str) -> None:
+        if self.checkpoint_store:
+            self.checkpoint_store.clear(endpoint)
 
     @staticmethod
     def _should_stop_pagination(current_page: int, max_pages: int, total_pages: int) -> bool:
         return (max_pages and current_page >= max_pages) or current_page >= total_pages
 
-    def fetch_movies(self, bookmark: datetime, max_pages: int, start_page: int = 1) -> list[dict]:
-        params = {'sort_by': 'primary_release_date.asc', 'release_date.gte': str(bookmark.date())}
-        data = self.fetch_api_data('discover/movie', params=params, start_page=start_page, max_pages=max_pages)
+    def fetch_movies(self, bookmark: datetime, max_pages: int, start_page: int = 1, sharded: bool = False) -> list[dict]:
+        data = self._collect(MOVIES_ENDPOINT, self.iter_movies(bookmark, max_pages, start_page, sharded))
         return data
 
-    def fetch_tv_shows(self, bookmark: datetime, max_pages: int, start_page: int = 1) -> list[dict]:
-        params = {'sort_by': 'first_air_date.asc', 'air_date.gte': str(bookmark.date())}
-        data = self.fetch_api_data('discover/tv', params=params, start_page=start_page, max_pages=max_pages)
+    def fetch_tv_shows(self, bookmark: datetime, max_pages: int, start_page: int = 1, sharded: bool = False) -> list[dict]:
+        data = self._collect(TV_SHOWS_ENDPOINT, self.iter_tv_shows(bookmark, max_pages, start_page, sharded))
         return data
+
+    def iter_movies(self, bookmark: datetime, max_pages: int, start_page: int = 1, sharded: bool = False) -> Iterator[list[dict]]:
+        if sharded:
+            params = _movie_params(bookmark)
+            return self.iter_sharded_pages(MOVIES_ENDPOINT, params, MOVIES_DATE_PARAMS, bookmark.date(), _today())
+        return self.iter_api_pages(MOVIES_ENDPOINT, params=_movie_params(bookmark), start_page=start_page, max_pages=max_pages)
+
+    def iter_tv_shows(self, bookmark: datetime, max_pages: int, start_page: int = 1, sharded: bool = False) -> Iterator[list[dict]]:
+        if sharded:
+            params = _tv_show_params(bookmark)
+            return self.iter_sharded_pages(TV_SHOWS_ENDPOINT, params, TV_SHOWS_DATE_PARAMS, bookmark.date(), _today())
+        return self.iter_api_pages(TV_SHOWS_ENDPOINT, params=_tv_show_params(bookmark), start_page=start_page, max_pages=max_pages)
+
+
+def _movie_params(bookmark: datetime) -> dict:
+    return {'sort_by': 'primary_release_date.asc', 'release_date.gte': str(bookmark.date())}
+
+
+def _tv_show_params(bookmark: datetime) -> dict:
+    return {'sort_by': 'first_air_date.asc', 'air_date.gte': str(bookmark.date())}
+
+
+def _today() -> date:
+    return datetime.now(UTC).date()
+
+
+def _split_window(window: DateWindow) -> list[tuple[date, date]]:
+    # Size the split from total_results with 2x headroom, since results are rarely spread evenly over the days
+    parts = min(window.days, max(2, 2 * math.ceil(window.total_results / (MAX_DISCOVER_PAGES * DISCOVER_PAGE_SIZE))))
+    days_per_part = math.ceil(window.days / parts)
+    return [
+        (window.start + timedelta(days=offset), min(window.start + timedelta(days=offset + days_per_part - 1), window.end))
+        for offset in range(0, window.days, days_per_part)
+    ]
@@ -34,7 +34,7 @@ def main(config_uri: str) -> None:
     config = config_repo.get(JobConfig)
     secret = SecretManager().get_secret(config.gs_secret_name)
     google_sheet = GoogleSheetFactory.from_credential_json(secret)
-    conn = ConnectionFactory.from_uri(str(config.db_uri))
+    conn = ConnectionFactory.from_uri(str(config.db_uri), pool_size=config.postgres_load_parallelism + 1)
     temp_dir = f'{TEMP_PATH}/google_sheet'
     log.info('Job args: %s', config)
     if not os.path.exists(temp_dir):
@@ -54,6 +54,12 @@ def main(config_uri: str) -> None:
             load_timestamp=datetime.now(UTC),
             primary_keys=config.primary_keys,
             range_column=config.range_column,
+            index_range_column=config.index_range_column,
+            merge_batch_size=config.merge_batch_size,
+            detect_changes=config.detect_changes,
+            load_type=config.load_type,
+            copy_mode=config.postgres_copy_mode,
+            load_parallelism=config.postgres_load_parallelism,
         )
         job = IngestJob(
             google_sheet=google_sheet,
@@ -7,9 +7,12 @@ import polars as pl
 from pydantic import AnyUrl, BaseModel
 
 from util.config import UpdateBookmark
+from util.dump_writer import DumpWriter, DumpWriterFactory
+from util.file_system import DataFrameFormat
 from util.google_sheet import GoogleSheet
 from util.logging import get_logger
-from util.table_copier import TableIngestor
+from util.metadata import LoadType
+from util.table_copier import PostgresCopyMode, TableIngestor
 
 log = get_logger(__name__)
 
@@ -27,6 +30,12 @@ class JobConfig(BaseModel):
     sheet_header_row_num: int = 0
     db_uri: AnyUrl
     gs_secret_name: str
+    postgres_copy_mode: str = PostgresCopyMode.SERVER_FILE
+    postgres_load_parallelism: int = 1
+    index_range_column: bool = False
+    merge_batch_size: int | None = None
+    detect_changes: bool = False
+    load_type: str = LoadType.INCREMENTAL
 
 
 class IngestJob:
@@ -53,13 +62,12 @@ class IngestJob:
         if df.is_empty():
             log.info('No data to ingest')
             return
-        dump_path = f'{self.temp_dir}/{self.config.table_name.replace(".", "_")}.csv'
-        # df.write_parquet(f'{TEMP_PATH}/{self.config.table_name.replace(".", "_")}.parquet')
-        df.write_csv(dump_path, separator='|', null_value=None)
+        with self._create_dump_writer() as writer:
+            writer.write(df)
         log.info('Saved temp files!')
         self._create_temp_table(df)
         log.info(f'Created temporary table {self.table_ingestor.temp_table}')
-        self.table_ingestor.execute(dump_path)
+        self.table_ingestor.execute(writer.dump_path)
         log.info(f'Ingested data for table {self.config.table_name}!')
         self.update_bookmark(self.utc_now)
         log.info('Updated bookmark: %s', self.utc_now)
@@ -77,11 +85,16 @@ class IngestJob:
             raise ValueError(f'Found duplicate columns: {duplicates}')
         return df
 
+    def _create_dump_writer(self) -> DumpWriter:
+        dump_format = self.table_ingestor.dump_format
+        dump_path = f'{self.temp_dir}/{self.config.table_name.replace(".", "_")}'
+        if dump_format == DataFrameFormat.CSV:
+            dump_path += '.csv'
+        return DumpWriterFactory.from_format(dump_format, dump_path)
+
     def _create_temp_table(self, df: pl.DataFrame):
         log.info(f'Creating temporary table {self.table_ingestor.temp_table}')
-        df = df.remove()
-        with self.table_ingestor.engine.connect() as conn:
-            df.write_database(self.table_ingestor.temp_table, connection=conn, if_table_exists='replace')
+        self.table_ingestor.create_temp_table(df.remove())
 
     @staticmethod
     def _rename_cols(cols: list[str]) -> dict[str, str]:
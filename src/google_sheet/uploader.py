@@ -21,6 +21,9 @@ class JobConfig(BaseModel):
     limit: int | None = 1000
     db_uri: AnyUrl
     gs_secret_name: str
+    # Integer column splitting the read into read_partitions parallel queries, where the database supports it
+    partition_on: str | None = None
+    read_partitions: int = 1
 
 
 class UploadGoogleSheetJob:
@@ -57,5 +60,9 @@ class UploadGoogleSheetJob:
         return query
 
     def _fetch_data(self, query: str) -> pl.DataFrame:
-        with self.conn.get_sqlalchemy_engine() as engine, engine.connect() as conn:
-            return pl.read_database(query=query, connection=conn)
+        partitions = self.config.read_partitions
+        if self.config.limit and partitions > 1:
+            # Each partition would apply the limit to its own unordered slice, so a limited read stays a single query
+            log.info(f'Reading {self.config.table_name} in one query instead of {partitions}, it is limited to {self.config.limit} rows')
+            partitions = 1
+        return self.conn.read_arrow(query, partition_on=self.config.partition_on, partitions=partitions)
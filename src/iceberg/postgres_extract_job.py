@@ -0,0 +1,160 @@
+import sys
+
+from pydantic import AnyUrl, BaseModel
+from pyspark.sql import DataFrame, DataFrameReader
+from pyspark.sql.functions import col
+
+from util.config import ConfigFactory
+from util.iceberg import Iceberg
+from util.local_env import CATALOG_URI
+from util.logging import configure_logging, get_logger, log_execution_time
+from util.metadata import LoadType, Metadata, MetadataRepository
+from util.spark_session_factory import SparkSessionFactory
+
+configure_logging()
+log = get_logger(__name__)
+
+POSTGRES_JDBC_DRIVER = 'org.postgresql.Driver'
+# information_schema data types Spark's JDBC reader can split into partition ranges
+PARTITIONABLE_TYPES = {
+    'smallint',
+    'integer',
+    'bigint',
+    'numeric',
+    'real',
+    'double precision',
+    'date',
+    'timestamp without time zone',
+    'timestamp with time zone',
+}
+
+
+class JobConfig(BaseModel):
+    db_uri: AnyUrl
+    metadata_uri: str
+    job_name: str
+    num_partitions: int = 8
+    fetch_size: int = 10_000
+
+
+class PostgresExtractJob:
+    # Rows newer than the bookmark are read over num_partitions JDBC connections, each scanning one slice of the partition
+    # column, so the extraction scales with executor cores instead of one connection streaming the whole table
+    def __init__(self, config: JobConfig, metadata: Metadata, iceberg: Iceberg, metadata_repo: MetadataRepository):
+        self.config = config
+        self.metadata = metadata
+        self.iceberg = iceberg
+        self.metadata_repo = metadata_repo
+
+    def run(self) -> None:
+        self._validate()
+        source = self.metadata.source_schema_table
+        new_rows = self._new_rows_condition()
+        partition_on = self._partition_column(self._column_types())
+        bounds = self._query(f'SELECT {", ".join(self._bounds_columns(partition_on))} FROM {source} WHERE {new_rows}').first()
+        if bounds['row_count'] == 0:
+            log.info(f'No new rows in {source}')
+            return
+
+        condition = new_rows
+        if self.metadata.range_column:
+            # The upper end is pinned to the bookmark read above, so rows committed meanwhile are left for the next run
+            condition = f"{new_rows} AND {self.metadata.range_column} <= '{bounds['bookmark']}'"
+        reader = self._reader().option('dbtable', f'(SELECT * FROM {source} WHERE {condition}) AS source')
+        if partition_on and bounds['lower_bound'] is not None:
+            log.info(
+                f'Extracting {source} where {condition} over {self.config.num_partitions} partitions of {partition_on} '
+                f'[{bounds["lower_bound"]}, {bounds["upper_bound"]}]'
+            )
+            reader = (
+                reader.option('partitionColumn', partition_on)
+                .option('lowerBound', str(bounds['lower_bound']))
+                .option('upperBound', str(bounds['upper_bound']))
+                .option('numPartitions', self.config.num_partitions)
+            )
+        else:
+            log.info(f'Extracting {source} where {condition} over a single connection, no column to partition on')
+        self._save(reader.load())
+        if self.metadata.range_column:
+            self.metadata_repo.update_bookmark(self.metadata.full_table_name, str(bounds['bookmark']))
+        log.info(f'Extracted {source} to {self.metadata.full_table_name}, bookmark {bounds["bookmark"]}')
+
+    def _validate(self) -> None:
+        # Incremental loads read past the bookmark on the range column and merge into Iceberg by key
+        if self.metadata.load_type == LoadType.FULL_REFRESH:
+            return
+        if not self.metadata.range_column:
+            raise ValueError(f'Incremental load of {self.metadata.full_table_name} needs a range_column')
+        if not self.metadata.primary_keys:
+            raise ValueError(f'Incremental load of {self.metadata.full_table_name} needs primary_keys to merge on')
+
+    def _new_rows_condition(self) -> str:
+        if self.metadata.load_type == LoadType.FULL_REFRESH or not self.metadata.range_column or not self.metadata.bookmark:
+            return '1=1'
+        return f"{self.metadata.range_column} > '{self.metadata.bookmark}'"
+
+    def _bounds_columns(self, partition_on: str | None) -> list[str]:
+        columns = ['COUNT(*) AS row_count']
+        if partition_on:
+            columns += [f'MIN({partition_on}) AS lower_bound', f'MAX({partition_on}) AS upper_bound']
+        if self.metadata.range_column:
+            columns.append(f'MAX({self.metadata.range_column}) AS bookmark')
+        return columns
+
+    def _column_types(self) -> dict[str, str]:
+        schema, _, table = self.metadata.source_schema_table.rpartition('.')
+        query = f"""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = '{schema or 'public'}' AND table_name = '{table}'"""
+        return {row['column_name']: row['data_type'] for row in self._query(query).collect()}
+
+    def _partition_column(self, column_types: dict[str, str]) -> str | None:
+        # Spark only splits numeric, date or timestamp columns into ranges: the configured column or a single-column key
+        # spreads best, then the range column. Without any of them the table is read over one connection.
+        candidates = [self.metadata.partition_column]
+        if self.metadata.primary_keys and len(self.metadata.primary_keys) == 1:
+            candidates.append(self.metadata.primary_keys[0])
+        candidates.append(self.metadata.range_column)
+        return next((column for column in candidates if column and column_types.get(column) in PARTITIONABLE_TYPES), None)
+
+    def _save(self, df: DataFrame) -> None:
+        partition_col = col(self.metadata.partition_column) if self.metadata.partition_column else None
+        if self.metadata.load_type == LoadType.FULL_REFRESH:
+            self.iceberg.replace_spark_df(df, self.metadata.full_table_name, partition_col)
+        else:
+            self.iceberg.merge_spark_df(df, self.metadata.full_table_name, self.metadata.primary_keys, partition_col)
+
+    def _query(self, query: str) -> DataFrame:
+        return self._reader().option('query', query).load()
+
+    def _reader(self) -> DataFrameReader:
+        db_uri = self.config.db_uri
+        return (
+            self.iceberg.spark.read.format('jdbc')
+            .option('url', f'jdbc:postgresql://{db_uri.host}:{db_uri.port}{db_uri.path}')
+            .option('user', db_uri.username)
+            .option('password', db_uri.password)
+            .option('driver', POSTGRES_JDBC_DRIVER)
+            .option('fetchsize', self.config.fetch_size)
+        )
+
+
+@log_execution_time(log)
+def main(config_uri: str) -> None:
+    config = ConfigFactory.from_uri(config_uri).get(JobConfig)
+    metadata_repo = MetadataRepository.from_uri(config.metadata_uri)
+    iceberg = Iceberg(SparkSessionFactory.from_uri(CATALOG_URI))
+    for metadata in metadata_repo.get_by_job_name(config.job_name):
+        if not metadata.is_active:
+            log.info(f'Skipping inactive table {metadata.full_table_name}')
+            continue
+        try:
+            PostgresExtractJob(config=config, metadata=metadata, iceberg=iceberg, metadata_repo=metadata_repo).run()
+        except Exception as e:
+            # Tables after the failed one are not extracted, so the run fails with the table it stopped at
+            log.error(f'Extracting {metadata.source_schema_table} to {metadata.full_table_name} failed: {e}')
+            raise RuntimeError(f'Job {config.job_name} failed on {metadata.full_table_name}') from e
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
@@ -0,0 +1,145 @@
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+import numpy as np
+import polars as pl
+import sqlalchemy as sa
+
+from util.connection_factory import ConnectionFactory, ConnectionType
+from util.logging import configure_logging, get_logger
+from util.pg_binary_copy import cast_for_copy, encode_rows
+from util.table_copier import PostgresCopyMode, TableIngestorFactory
+
+configure_logging()
+log = get_logger(__name__)
+
+TABLE = 'copy_benchmark.destination'
+COLUMN_TYPES = {
+    'id': 'BIGINT',
+    'title': 'TEXT',
+    'overview': 'TEXT',
+    'popularity': 'DOUBLE PRECISION',
+    'vote_average': 'DOUBLE PRECISION',
+    'vote_count': 'INTEGER',
+    'adult': 'BOOLEAN',
+    'release_date': 'DATE',
+    'loaded_at': 'TIMESTAMP WITH TIME ZONE',
+}
+# struct formats the per-value encoder packed the fixed-width columns above with
+LEGACY_FORMATS = {'BIGINT': 'q', 'DOUBLE PRECISION': 'd', 'INTEGER': 'i', 'BOOLEAN': '?', 'DATE': 'i', 'TIMESTAMP WITH TIME ZONE': 'q'}
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compare binary COPY FROM STDIN with COPY from a server-side CSV file')
+    parser.add_argument('--db-uri', help='postgres:// URI, only the client-side encoders are timed without one')
+    parser.add_argument('--dump-dir', help='directory the database server can read the CSV dump from, a temp dir by default')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def sample_frame(rows: int) -> pl.DataFrame:
+    ids = np.arange(rows)
+    return pl.DataFrame(
+        {
+            'id': ids,
+            'title': [f'Movie {i}' for i in ids],
+            'overview': [f'Overview of movie {i} ' * (i % 8) if i % 5 else None for i in ids],
+            'popularity': ids % 1000 / 10,
+            'vote_average': np.where(ids % 7 == 0, np.nan, ids % 100 / 10),
+            'vote_count': (ids % 5000).astype(np.int32),
+            'adult': ids % 11 == 0,
+            'release_date': pl.Series(ids % 20_000, dtype=pl.Int32).cast(pl.Date),
+            'loaded_at': [datetime.now(UTC)] * rows,
+        }
+    ).with_columns(pl.col('vote_average').fill_nan(None))
+
+
+def legacy_encode_rows(df: pl.DataFrame, column_types: dict[str, str]) -> bytes:
+    # The per-value encoder binary COPY started out with: one struct.pack call per field
+    df = df.select(cast_for_copy(column, pg_type) for column, pg_type in column_types.items())
+    packers = [struct.Struct(f'>i{LEGACY_FORMATS[pg_type]}') if pg_type in LEGACY_FORMATS else None for pg_type in column_types.values()]
+    field_count = struct.pack('>h', len(packers))
+    rows = bytearray()
+    for row in df.iter_rows():
+        rows += field_count
+        for packer, value in zip(packers, row, strict=True):
+            if value is None:
+                rows += struct.pack('>i', -1)
+            elif packer is None:
+                data = value.encode()
+                rows += struct.pack('>i', len(data)) + data
+            else:
+                rows += packer.pack(packer.size - 4, value)
+    return bytes(rows)
+
+
+def time_encoder(encode, df: pl.DataFrame, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        payload = encode(df, COLUMN_TYPES)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings), len(payload)
+
+
+def time_load(engine: sa.Engine, copy_mode: str, df: pl.DataFrame, dump_dir: str, repeat: int) -> float:
+    ingestor = TableIngestorFactory.from_connection_type(
+        conn_type=ConnectionType.POSTGRES,
+        engine=engine,
+        table=TABLE,
+        load_timestamp=datetime.now(UTC),
+        primary_keys=['id'],
+        range_column='id',
+        copy_mode=copy_mode,
+    )
+    if copy_mode == PostgresCopyMode.BINARY_STDIN:
+        dump_path = f'{dump_dir}/binary'
+        os.makedirs(dump_path, exist_ok=True)
+        df.write_parquet(f'{dump_path}/part-00000.parquet', row_group_size=100_000)
+    else:
+        dump_path = f'{dump_dir}/dump.csv'
+        df.write_csv(dump_path, separator='|')
+    # Timed through the whole load, so both modes pay the same merge into the destination on top of their COPY
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        ingestor.execute(dump_path)
+        timings.append(time.perf_counter() - started_at)
+    return min(timings)
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    df = sample_frame(args.rows)
+
+    legacy_seconds, size = time_encoder(legacy_encode_rows, df, args.repeat)
+    columnar_seconds, _ = time_encoder(encode_rows, df, args.repeat)
+    for name, seconds in [('Per-value encoder', legacy_seconds), ('Column-wise encoder', columnar_seconds)]:
+        log.info(f'{name}: {seconds:.3f}s, {args.rows / seconds:.0f} rows/s, {size / 1024 / 1024 / seconds:.1f} MB/s')
+    log.info(f'Encoder speedup: {legacy_seconds / columnar_seconds:.1f}x')
+    if not args.db_uri:
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = ConnectionFactory.from_uri(args.db_uri)
+        with conn.get_sqlalchemy_engine() as engine:
+            with engine.begin() as db:
+                db.execute(sa.text('CREATE SCHEMA IF NOT EXISTS copy_benchmark'))
+            dump_dir = args.dump_dir or temp_dir
+            server_file_seconds = time_load(engine, PostgresCopyMode.SERVER_FILE, df, dump_dir, args.repeat)
+            binary_seconds = time_load(engine, PostgresCopyMode.BINARY_STDIN, df, dump_dir, args.repeat)
+            log.info(f'COPY from server CSV file: {server_file_seconds:.3f}s, {args.rows / server_file_seconds:.0f} rows/s')
+            log.info(f'Binary COPY FROM STDIN: {binary_seconds:.3f}s, {args.rows / binary_seconds:.0f} rows/s')
+            log.info(f'Binary vs server file: {server_file_seconds / binary_seconds:.2f}x')
+            with engine.begin() as db:
+                db.execute(sa.text('DROP SCHEMA copy_benchmark CASCADE'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+import argparse
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+
+import sqlalchemy as sa
+
+from util.connection_factory import ConnectionFactory
+from util.logging import configure_logging, get_logger
+from util.table_copier import TableIngestorFactory
+
+configure_logging()
+log = get_logger(__name__)
+
+TABLE = 'delete_benchmark.destination'
+PRIMARY_KEYS = ['id', 'part']
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compare the string-concat and typed key deletes of the table ingestors')
+    parser.add_argument('--db-uri', help='postgres:// or duckdb:// URI, a temporary DuckDB file is used by default')
+    parser.add_argument('--rows', type=int, default=5_000_000, help='rows in the destination table')
+    parser.add_argument('--keys', type=int, default=100_000, help='keys in the temp table to delete')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-primary-key', action='store_true', help='benchmark a destination without a primary key')
+    return parser.parse_args(argv)
+
+
+def legacy_delete_query(temp_table: str) -> str:
+    casted_keys = [f"COALESCE(CAST({key} AS VARCHAR), '')" for key in PRIMARY_KEYS]
+    key_concat = " || '-' || ".join(casted_keys)
+    return f"""
+        DELETE FROM {TABLE}
+        WHERE {key_concat} IN (
+            SELECT DISTINCT {key_concat} FROM {temp_table}
+        )"""
+
+
+def create_tables(engine: sa.Engine, temp_table: str, args: argparse.Namespace) -> None:
+    step = max(args.rows // args.keys, 1)
+    statements = [
+        'DROP SCHEMA IF EXISTS delete_benchmark CASCADE',
+        'CREATE SCHEMA delete_benchmark',
+        f"""
+        CREATE TABLE {TABLE} AS
+            SELECT g AS id, g % 7 AS part, md5(CAST(g AS VARCHAR)) AS payload
+            FROM generate_series(1, {args.rows}) AS s(g)""",
+        f'CREATE TABLE {temp_table} AS SELECT id, part, payload FROM {TABLE} WHERE id % {step} = 0',
+    ]
+    if not args.no_primary_key:
+        statements.append(f'ALTER TABLE {TABLE} ADD PRIMARY KEY ({", ".join(PRIMARY_KEYS)})')
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(sa.text(statement))
+
+
+def time_delete(engine: sa.Engine, query: str, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            started_at = time.perf_counter()
+            conn.execute(sa.text(query))
+            timings.append(time.perf_counter() - started_at)
+            # rowcount is not reported by every driver
+            remaining = conn.execute(sa.text(f'SELECT count(*) FROM {TABLE}')).scalar()
+            # Roll back so every run deletes from the same table
+            transaction.rollback()
+    return min(timings), remaining
+
+
+def main(argv: list[str]) -> None:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        conn = ConnectionFactory.from_uri(args.db_uri or f'duckdb://{temp_dir}/benchmark.duckdb')
+        with conn.get_sqlalchemy_engine() as engine:
+            ingestor = TableIngestorFactory.from_connection_type(
+                conn_type=conn.type,
+                engine=engine,
+                table=TABLE,
+                load_timestamp=datetime.now(UTC),
+                primary_keys=PRIMARY_KEYS,
+                range_column='id',
+            )
+            log.info(f'Creating {TABLE} with {args.rows} rows and {ingestor.temp_table} with about {args.keys} keys')
+            create_tables(engine, ingestor.temp_table, args)
+
+            legacy_seconds, legacy_remaining = time_delete(engine, legacy_delete_query(ingestor.temp_table), args.repeat)
+            typed_seconds, typed_remaining = time_delete(engine, ingestor.create_delete_query(), args.repeat)
+            log.info(f'String-concat key delete: {legacy_seconds:.3f}s, {args.rows - legacy_remaining} rows')
+            log.info(f'Typed key delete: {typed_seconds:.3f}s, {args.rows - typed_remaining} rows')
+            log.info(f'Speedup: {legacy_seconds / typed_seconds:.1f}x')
+
+            with engine.begin() as db:
+                db.execute(sa.text('DROP SCHEMA delete_benchmark CASCADE'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
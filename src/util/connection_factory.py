@@ -1,22 +1,52 @@
+import atexit
+import threading
+import time
 from abc import ABC, abstractmethod
-from collections.abc import Generator
+from collections.abc import Generator, Iterator
 from contextlib import contextmanager
+from dataclasses import dataclass
 from enum import Enum
 from typing import Any
 from urllib.parse import urlparse
 
+import duckdb
+import polars as pl
 import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
 
 from util.credentials import Credentials
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_FETCH_SIZE = 10_000
+
+# Polars type for the Postgres type OIDs a cursor reports, so every streamed batch gets the same schema
+_POSTGRES_OID_TYPES: dict[int, pl.DataType] = {
+    16: pl.Boolean(),
+    20: pl.Int64(),
+    21: pl.Int16(),
+    23: pl.Int32(),
+    25: pl.Utf8(),
+    700: pl.Float32(),
+    701: pl.Float64(),
+    1042: pl.Utf8(),
+    1043: pl.Utf8(),
+    1082: pl.Date(),
+    1114: pl.Datetime('us'),
+    1184: pl.Datetime('us', 'UTC'),
+}
 
 
 class ConnectionFactory:
     @staticmethod
-    def from_uri(uri: str) -> 'Connection':
+    def from_uri(uri: str, pool_size: int = DEFAULT_POOL_SIZE) -> 'Connection':
         parsed_uri = urlparse(uri)
         if parsed_uri.scheme == 'postgres':
             creds = Credentials(parsed_uri.username, parsed_uri.password)
-            return PostgresConnection(parsed_uri.hostname, parsed_uri.port, parsed_uri.path[1:], creds)
+            return PostgresConnection(parsed_uri.hostname, parsed_uri.port, parsed_uri.path[1:], creds, pool_size)
         elif parsed_uri.scheme == 'duckdb':
             return DuckDBConnection(parsed_uri.path)
         else:
@@ -28,6 +58,135 @@ class ConnectionType(Enum):
     DUCKDB = 'duckdb'
 
 
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def record_checkout(self, wait_seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds += wait_seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a free connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+        self._metrics_lock = threading.Lock()
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            with self._metrics_lock:
+                self.metrics.record_checkout(time.perf_counter() - started_at)
+
+
+class EngineRegistry:
+    # One engine, and with it one connection pool, per URL and engine options for the whole process, so a caller asking
+    # for a bigger pool gets one even when another component connected to the same URL first. Engines are disposed at exit.
+    def __init__(self):
+        self._engines: dict[tuple[str, tuple[tuple[str, Any], ...]], sa.Engine] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, **engine_options: Any) -> sa.Engine:
+        key = (url, tuple(sorted(engine_options.items())))
+        with self._lock:
+            if key not in self._engines:
+                self._engines[key] = sa.create_engine(url, poolclass=TimedQueuePool, pool_pre_ping=True, **engine_options)
+            return self._engines[key]
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            engines = list(self._engines.items())
+        return {_engine_name(key, engine): _pool_metrics(engine.pool) for key, engine in engines}
+
+    def dispose_all(self) -> None:
+        with self._lock:
+            engines = list(self._engines.items())
+            self._engines.clear()
+        for key, engine in engines:
+            log.info(f'Disposing engine {_engine_name(key, engine)}: {_pool_metrics(engine.pool)}')
+            engine.dispose()
+
+
+def _engine_name(key: tuple[str, tuple[tuple[str, Any], ...]], engine: sa.Engine) -> str:
+    _, engine_options = key
+    name = engine.url.render_as_string(hide_password=True)
+    if engine_options:
+        name += f' ({", ".join(f"{option}={value}" for option, value in engine_options)})'
+    return name
+
+
+def _pool_metrics(pool: sa.Pool) -> dict[str, float]:
+    metrics = pool.metrics if isinstance(pool, TimedQueuePool) else PoolMetrics()
+    return {
+        'pool_size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': metrics.checkouts,
+        'wait_seconds': metrics.wait_seconds,
+        'max_wait_seconds': metrics.max_wait_seconds,
+    }
+
+
+engine_registry = EngineRegistry()
+atexit.register(engine_registry.dispose_all)
+
+
+def read_arrow(engine: sa.Engine, query: str, partition_on: str | None = None, partitions: int = 1) -> pl.DataFrame:
+    # Results are built from Arrow buffers instead of Python row tuples: DuckDB hands them over natively, Postgres goes
+    # through connectorx
+    if engine.dialect.name == 'duckdb':
+        # DuckDB already scans in parallel, so a partitioned read would only add queries
+        with native_duckdb_connection(engine) as conn:
+            return conn.execute(query).pl()
+    if engine.dialect.name == 'postgresql':
+        uri = engine.url.render_as_string(hide_password=False)
+        if partition_on and partitions > 1:
+            return pl.read_database_uri(query, uri, engine='connectorx', partition_on=partition_on, partition_num=partitions)
+        return pl.read_database_uri(query, uri, engine='connectorx')
+
+    # Only SQLite, which tests use, is left to read rows through SQLAlchemy
+    with engine.connect() as conn:
+        return pl.read_database(query, connection=conn)
+
+
+def stream_batches(engine: sa.Engine, query: str, fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[pl.DataFrame]:
+    # Yields the result fetch_size rows at a time while the query is still running, so memory stays flat however large the
+    # result is. Postgres reads through a named server-side cursor, DuckDB hands out Arrow record batches.
+    if engine.dialect.name == 'duckdb':
+        with native_duckdb_connection(engine) as conn:
+            for batch in conn.execute(query).fetch_record_batch(fetch_size):
+                yield pl.from_arrow(batch)
+        return
+
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=fetch_size) as conn:
+        result = conn.execute(sa.text(query))
+        columns = list(result.keys())
+        types = {
+            name: _POSTGRES_OID_TYPES[column[1]]
+            for name, column in zip(columns, result.cursor.description, strict=True)
+            if column[1] in _POSTGRES_OID_TYPES
+        }
+        for rows in result.partitions(fetch_size):
+            yield pl.DataFrame(rows, schema=columns, orient='row', infer_schema_length=None).cast(types)
+
+
+@contextmanager
+def native_duckdb_connection(engine: sa.Engine) -> Generator[duckdb.DuckDBPyConnection, Any]:
+    # Borrowed from the engine's pool, so it shares the database instance the engine opened and goes back to the pool after
+    connection = engine.raw_connection()
+    try:
+        yield connection.driver_connection
+    finally:
+        connection.close()
+
+
 class Connection(ABC):
     @property
     @abstractmethod
@@ -38,13 +197,22 @@ class Connection(ABC):
     def get_sqlalchemy_engine(self) -> sa.engine.base.Engine:
         pass
 
+    def read_arrow(self, query: str, partition_on: str | None = None, partitions: int = 1) -> pl.DataFrame:
+        with self.get_sqlalchemy_engine() as engine:
+            return read_arrow(engine, query, partition_on, partitions)
+
+    def stream_batches(self, query: str, fetch_size: int = DEFAULT_FETCH_SIZE) -> Iterator[pl.DataFrame]:
+        with self.get_sqlalchemy_engine() as engine:
+            yield from stream_batches(engine, query, fetch_size)
+
 
 class PostgresConnection(Connection):
-    def __init__(self, host: str, port: int, database: str, credentials: Credentials):
+    def __init__(self, host: str, port: int, database: str, credentials: Credentials, pool_size: int = DEFAULT_POOL_SIZE):
         self.host = host
         self.port = port
         self.database = database
         self.credentials = credentials
+        self.pool_size = pool_size
 
     @property
     def type(self) -> ConnectionType:
@@ -52,15 +220,11 @@ class PostgresConnection(Connection):
 
     @contextmanager
     def get_sqlalchemy_engine(self) -> Generator[sa.Engine, Any]:
-        engine = self._create_engine()
-        try:
-            yield engine
-        finally:
-            engine.dispose()
+        yield self._create_engine()
 
     def _create_engine(self):
         url = f'postgresql://{self.credentials.username}:{self.credentials.password}@{self.host}:{self.port}/{self.database}'
-        return sa.create_engine(url, pool_size=100, max_overflow=200, echo=False)
+        return engine_registry.get(url, pool_size=self.pool_size, max_overflow=DEFAULT_MAX_OVERFLOW, echo=False)
 
 
 class DuckDBConnection(Connection):
@@ -71,15 +235,19 @@ class DuckDBConnection(Connection):
     def type(self) -> ConnectionType:
         return ConnectionType.DUCKDB
 
+    @contextmanager
+    def get_duckdb_connection(self) -> Generator[duckdb.DuckDBPyConnection, Any]:
+        with self.get_sqlalchemy_engine() as engine, native_duckdb_connection(engine) as conn:
+            yield conn
+
     @contextmanager
     def get_sqlalchemy_engine(self) -> Generator[sa.Engine, Any]:
-        engine = self._create_engine()
+        if self.path:
+            yield engine_registry.get(f'duckdb:///{self.path}')
+            return
+        # Every in-memory engine is its own database, so it cannot be shared through the registry
+        engine = sa.create_engine('duckdb:///:memory:')
         try:
             yield engine
         finally:
             engine.dispose()
-
-    def _create_engine(self):
-        if self.path:
-            return sa.create_engine(f'duckdb:///{self.path}')
-        return sa.create_engine('duckdb:///:memory:')
@@ -0,0 +1,106 @@
+import os
+from abc import ABC, abstractmethod
+
+import polars as pl
+
+from util.file_system import DataFrameFormat
+from util.logging import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_ROW_GROUP_SIZE = 100_000
+
+
+class DumpWriterFactory:
+    @staticmethod
+    def from_format(df_format: DataFrameFormat, dump_path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> 'DumpWriter':
+        if df_format == DataFrameFormat.PARQUET:
+            return ParquetDumpWriter(dump_path, row_group_size)
+        elif df_format == DataFrameFormat.CSV:
+            return CsvDumpWriter(dump_path)
+        else:
+            raise ValueError(f'Unsupported dump format: {df_format}')
+
+
+class DumpWriter(ABC):
+    def __init__(self, dump_path: str):
+        self.dump_path = dump_path
+        self.rows = 0
+
+    def __enter__(self) -> 'DumpWriter':
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.close()
+
+    def write(self, df: pl.DataFrame) -> None:
+        if df.is_empty():
+            return
+        self._write(df)
+        self.rows += df.height
+
+    @abstractmethod
+    def _write(self, df: pl.DataFrame) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class ParquetDumpWriter(DumpWriter):
+    # The dump is a directory with one part file per row group so it can be read as `read_parquet('{dump_path}/*.parquet')`.
+    # Parts are written by Polars itself: DataFrame.to_arrow holds the GIL while it waits on the Polars thread pool, which
+    # deadlocks against a lazy collect running in another table's thread.
+    def __init__(self, dump_path: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(dump_path)
+        self.row_group_size = row_group_size
+        self._buffer: list[pl.DataFrame] = []
+        self._buffered_rows = 0
+        self._parts = 0
+        self._schema: pl.Schema | None = None
+
+    def _write(self, df: pl.DataFrame) -> None:
+        self._buffer.append(df)
+        self._buffered_rows += df.height
+        if self._buffered_rows >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        if self._parts:
+            log.info(f'Wrote {self.rows} rows to {self.dump_path} in {self._parts} parts')
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        # Relaxed concat promotes all-null page columns to the type seen on other pages of the same row group
+        df = pl.concat(self._buffer, how='vertical_relaxed')
+        self._buffer, self._buffered_rows = [], 0
+        if self._schema is None:
+            self._schema = df.schema
+        else:
+            df = df.select([pl.col(name).cast(dtype, strict=False) for name, dtype in self._schema.items()])
+        os.makedirs(self.dump_path, exist_ok=True)
+        df.write_parquet(f'{self.dump_path}/part-{self._parts:05d}.parquet', row_group_size=self.row_group_size)
+        self._parts += 1
+
+
+class CsvDumpWriter(DumpWriter):
+    def __init__(self, dump_path: str):
+        super().__init__(dump_path)
+        self._file = None
+        self._columns: list[str] = []
+
+    def _write(self, df: pl.DataFrame) -> None:
+        include_header = self._file is None
+        if self._file is None:
+            self._file = open(self.dump_path, 'wb')
+            self._columns = df.columns
+        df.select(self._columns).write_csv(self._file, separator='|', null_value=None, include_header=include_header)
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+            log.info(f'Wrote {self.rows} rows to {self.dump_path}')
@@ -1,4 +1,4 @@
-from pyspark.sql import Column, SparkSession
+from pyspark.sql import Column, DataFrameWriterV2, SparkSession
 from pyspark.sql.dataframe import DataFrame as SparkDataFrame
 
 CATALOG_NAME = 'iceberg_catalog'
@@ -16,13 +16,38 @@ class Iceberg:
             self._create_table(df, full_table_name, partition_col)
 
     @staticmethod
-    def _create_table(df: SparkDataFrame, full_table_name: str, partition_col: Column) -> None:
-        (df.writeTo(f'{CATALOG_NAME}.{full_table_name}').tableProperty('format-version', '2').partitionedBy(partition_col).create())
+    def _create_table(df: SparkDataFrame, full_table_name: str, partition_col: Column | None) -> None:
+        Iceberg._table_writer(df, full_table_name, partition_col).create()
+
+    @staticmethod
+    def _table_writer(df: SparkDataFrame, full_table_name: str, partition_col: Column | None) -> DataFrameWriterV2:
+        writer = df.writeTo(f'{CATALOG_NAME}.{full_table_name}').tableProperty('format-version', '2')
+        return writer.partitionedBy(partition_col) if partition_col is not None else writer
 
     @staticmethod
     def _overwrite_partition(df: SparkDataFrame, full_table_name: str) -> None:
         df.writeTo(f'{CATALOG_NAME}.{full_table_name}').overwritePartitions()
 
+    def merge_spark_df(self, df: SparkDataFrame, full_table_name: str, primary_keys: list[str], partition_col: Column | None) -> None:
+        # Incremental batches only hold changed rows, so they are merged by key instead of overwriting whole partitions
+        if not self.table_exists(full_table_name):
+            self._create_table(df, full_table_name, partition_col)
+            return
+        view_name = f'{full_table_name.replace(".", "_")}_changes'
+        df.createOrReplaceTempView(view_name)
+        same_key = ' AND '.join(f'target.{key} = source.{key}' for key in primary_keys)
+        self.spark.sql(f"""
+            MERGE INTO {CATALOG_NAME}.{full_table_name} AS target
+            USING {view_name} AS source
+            ON {same_key}
+            WHEN MATCHED THEN UPDATE SET *
+            WHEN NOT MATCHED THEN INSERT *""")
+        self.spark.catalog.dropTempView(view_name)
+
+    def replace_spark_df(self, df: SparkDataFrame, full_table_name: str, partition_col: Column | None) -> None:
+        # A full refresh commits the new table contents as one snapshot, so readers never see a partial table
+        self._table_writer(df, full_table_name, partition_col).createOrReplace()
+
     def table_exists(self, full_table_name: str) -> bool:
         schema_name, table_name = full_table_name.split('.')
         return (
@@ -4,6 +4,13 @@ from dataclasses import dataclass
 from urllib.parse import urlparse
 
 
+class LoadType:
+    # Rows are merged into the destination table by key
+    INCREMENTAL = 'incremental'
+    # The destination table is rebuilt from the dump and swapped in
+    FULL_REFRESH = 'full_refresh'
+
+
 @dataclass
 class Metadata:
     schema_name: str
@@ -0,0 +1,202 @@
+import struct
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+import numpy as np
+import polars as pl
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+TRAILER = struct.pack('>h', -1)
+NULL = struct.pack('>i', -1)
+
+# Postgres counts dates and timestamps from 2000-01-01, Polars from 1970-01-01
+PG_EPOCH_DAYS = 10_957
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * 86_400 * 1_000_000
+
+# Binary COPY has to send every value in exactly the destination column's wire format, so batches are cast to the
+# Polars type matching the column first and then converted to the big-endian NumPy type of the wire format
+_FIXED_WIDTH_TYPES: dict[str, tuple[pl.DataType, str]] = {
+    'SMALLINT': (pl.Int16, '>i2'),
+    'INTEGER': (pl.Int32, '>i4'),
+    'BIGINT': (pl.Int64, '>i8'),
+    'REAL': (pl.Float32, '>f4'),
+    'FLOAT': (pl.Float64, '>f8'),
+    'DOUBLE PRECISION': (pl.Float64, '>f8'),
+    'BOOLEAN': (pl.Boolean, 'u1'),
+    'DATE': (pl.Int32, '>i4'),
+    'TIMESTAMP': (pl.Int64, '>i8'),
+    'TIMESTAMP WITHOUT TIME ZONE': (pl.Int64, '>i8'),
+    'TIMESTAMP WITH TIME ZONE': (pl.Int64, '>i8'),
+}
+_TEXT_TYPES = {'TEXT', 'VARCHAR', 'CHARACTER VARYING', 'CHAR', 'CHARACTER'}
+# Column type a staging table gets for each Polars type when it is created from a dump's schema
+_POSTGRES_TYPES: dict[type[pl.DataType], str] = {
+    pl.Int8: 'SMALLINT',
+    pl.Int16: 'SMALLINT',
+    pl.Int32: 'INTEGER',
+    pl.Int64: 'BIGINT',
+    pl.UInt8: 'SMALLINT',
+    pl.UInt16: 'INTEGER',
+    pl.UInt32: 'BIGINT',
+    pl.UInt64: 'BIGINT',
+    pl.Float32: 'REAL',
+    pl.Float64: 'DOUBLE PRECISION',
+    pl.Boolean: 'BOOLEAN',
+    pl.Date: 'DATE',
+    pl.Utf8: 'TEXT',
+}
+# A row segment is either a (rows, width) byte matrix, or the values of all rows back to back with each row's length
+Segment = np.ndarray | tuple[np.ndarray, np.ndarray]
+
+
+@dataclass
+class CopyStats:
+    rows: int
+    bytes: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 1024 / 1024 / self.seconds if self.seconds else 0.0
+
+
+class BinaryCopyStream:
+    # File-like object psycopg2's copy_expert reads the COPY payload from, encoding one batch at a time
+    def __init__(self, batches: Iterable[pl.DataFrame], column_types: dict[str, str]):
+        self.column_types = column_types
+        self.rows = 0
+        self.bytes = 0
+        self._chunks = self._encode(batches)
+        self._buffer = bytearray()
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        size = len(self._buffer) if size < 0 else min(size, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes += len(data)
+        return data
+
+    def _encode(self, batches: Iterable[pl.DataFrame]) -> Iterator[bytes]:
+        yield HEADER
+        for df in batches:
+            self.rows += df.height
+            yield encode_rows(df, self.column_types)
+        yield TRAILER
+
+
+def encode_rows(df: pl.DataFrame, column_types: dict[str, str]) -> bytes:
+    # Encoded column by column with NumPy instead of value by value: every row is a run of segments, either the same
+    # width in all rows (field count, length prefixes, values of fixed-width columns without nulls) or variable width
+    # (text, columns with nulls). Adjacent fixed-width segments are stacked side by side, then every segment is
+    # scattered into its place in the rows.
+    if df.is_empty():
+        return b''
+    df = df.select(cast_for_copy(column, pg_type) for column, pg_type in column_types.items())
+    field_count = np.frombuffer(struct.pack('>h', len(column_types)), dtype=np.uint8)
+    segments: list[Segment] = [np.broadcast_to(field_count, (df.height, 2))]
+    for column, pg_type in column_types.items():
+        values, lengths, is_null = _encode_column(df[column], pg_type)
+        segments.append(np.where(is_null, -1, lengths).astype('>i4').view(np.uint8).reshape(-1, 4))
+        if _base_type(pg_type) in _TEXT_TYPES or is_null.any():
+            segments.append((values, lengths))
+        else:
+            segments.append(values.reshape(df.height, -1))
+    return _join_segments(_stack_fixed_segments(segments), df.height)
+
+
+def copy_binary(dbapi_connection, table: str, column_types: dict[str, str], batches: Iterable[pl.DataFrame]) -> CopyStats:
+    stream = BinaryCopyStream(batches, column_types)
+    columns = ', '.join(f'"{column}"' for column in column_types)
+    started_at = time.perf_counter()
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)', stream, size=COPY_BUFFER_SIZE)
+    return CopyStats(rows=stream.rows, bytes=stream.bytes, seconds=time.perf_counter() - started_at)
+
+
+def postgres_column_types(schema: pl.Schema) -> dict[str, str]:
+    return {name: _postgres_type(dtype) for name, dtype in schema.items()}
+
+
+def _postgres_type(dtype: pl.DataType) -> str:
+    if isinstance(dtype, pl.Datetime):
+        return 'TIMESTAMP WITH TIME ZONE' if dtype.time_zone else 'TIMESTAMP'
+    return _POSTGRES_TYPES.get(dtype.base_type(), 'TEXT')
+
+
+def _base_type(pg_type: str) -> str:
+    return pg_type.split('(')[0].strip().upper()
+
+
+def cast_for_copy(column: str, pg_type: str) -> pl.Expr:
+    base_type = _base_type(pg_type)
+    if base_type in _TEXT_TYPES:
+        return pl.col(column).cast(pl.Utf8)
+    if base_type == 'DATE':
+        return (pl.col(column).cast(pl.Date).cast(pl.Int32) - PG_EPOCH_DAYS).alias(column)
+    if base_type.startswith('TIMESTAMP'):
+        timestamp = pl.col(column).cast(pl.Datetime('us'))
+        return (timestamp.cast(pl.Int64) - PG_EPOCH_MICROSECONDS).alias(column)
+    if base_type in _FIXED_WIDTH_TYPES:
+        return pl.col(column).cast(_FIXED_WIDTH_TYPES[base_type][0])
+    raise ValueError(f'Unsupported column type for binary COPY: {column} {pg_type}')
+
+
+def _encode_column(series: pl.Series, pg_type: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Returns the values of the non-null rows back to back, the byte length of every row's value (0 when null) and the
+    # null mask
+    is_null = series.is_null().to_numpy()
+    base_type = _base_type(pg_type)
+    if base_type in _TEXT_TYPES:
+        lengths = series.str.len_bytes().fill_null(0).to_numpy().astype(np.int64)
+        values = series.str.join('', ignore_nulls=True).item().encode()
+        return np.frombuffer(values, dtype=np.uint8), lengths, is_null
+    dtype = np.dtype(_FIXED_WIDTH_TYPES[base_type][1])
+    values = series.drop_nulls().to_numpy().astype(dtype).view(np.uint8)
+    lengths = np.where(is_null, 0, dtype.itemsize).astype(np.int64)
+    return values, lengths, is_null
+
+
+def _stack_fixed_segments(segments: list[Segment]) -> list[Segment]:
+    stacked: list[Segment] = []
+    fixed: list[np.ndarray] = []
+    for segment in segments:
+        if isinstance(segment, np.ndarray):
+            fixed.append(segment)
+            continue
+        if fixed:
+            stacked.append(np.hstack(fixed))
+            fixed = []
+        stacked.append(segment)
+    if fixed:
+        stacked.append(np.hstack(fixed))
+    return stacked
+
+
+def _join_segments(segments: list[Segment], height: int) -> bytes:
+    if len(segments) == 1:
+        # Only fixed-width columns without nulls: every row has the same layout and the stacked bytes are the rows
+        return np.ascontiguousarray(segments[0]).tobytes()
+    widths = [np.full(height, segment.shape[1], dtype=np.int64) if isinstance(segment, np.ndarray) else segment[1] for segment in segments]
+    row_lengths = np.sum(widths, axis=0)
+    starts = np.cumsum(row_lengths) - row_lengths
+    rows = np.empty(int(row_lengths.sum()), dtype=np.uint8)
+    for segment, width in zip(segments, widths, strict=True):
+        if isinstance(segment, np.ndarray):
+            rows[starts[:, None] + np.arange(segment.shape[1])] = segment
+        elif segment[0].size:
+            values, lengths = segment
+            rows[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(values.size)] = values
+        starts = starts + width
+    return rows.tobytes()
@@ -1,18 +1,100 @@
+import glob
+import hashlib
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from functools import partial
 from typing import ClassVar
 
+import polars as pl
+import pyarrow.parquet as pq
 from sqlalchemy import inspect, text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.sql.elements import TextClause
 
-from util.connection_factory import ConnectionType
+from util.connection_factory import ConnectionType, native_duckdb_connection
+from util.file_system import DataFrameFormat
 from util.logging import get_logger
+from util.metadata import LoadType
+from util.pg_binary_copy import CopyStats, copy_binary, postgres_column_types
 
 log = get_logger(__name__)
 
+COPY_BATCH_SIZE = 50_000
+ROW_HASH_COLUMN = 'row_hash'
+
+
+class PostgresCopyMode:
+    # COPY ... FROM a CSV file that has to be readable by the database server
+    SERVER_FILE = 'server_file'
+    # COPY ... FROM STDIN in binary format, streamed from the client out of a Parquet dump
+    BINARY_STDIN = 'binary_stdin'
+
+
+# Columns of an index or primary key, and whether it is unique
+IndexColumns = tuple[list[str], bool]
+
+
+class SchemaCache:
+    # Reflected columns and indexes per (engine URL, table), shared by all ingestors in the process so multi-table jobs
+    # only query the catalog once per table. Ingestors invalidate the tables they issue DDL against.
+    def __init__(self):
+        self._columns: dict[tuple[str, str], list[dict]] = {}
+        self._indexes: dict[tuple[str, str], list[IndexColumns]] = {}
+        self._lock = threading.Lock()
+
+    def get_columns(self, engine: Engine, table: str) -> list[dict]:
+        key = (str(engine.url), table)
+        with self._lock:
+            if key in self._columns:
+                return self._columns[key]
+        schema, table_name = _schema_and_table(table)
+        inspector = inspect(engine)
+        columns = inspector.get_columns(table_name, schema=schema) if inspector.has_table(table_name, schema=schema) else []
+        with self._lock:
+            self._columns[key] = columns
+        return columns
+
+    def get_indexes(self, engine: Engine, table: str, reflect: Callable[[], list[IndexColumns]]) -> list[IndexColumns]:
+        # Dialects read indexes from different catalogs, so the ingestor passes in how to reflect them
+        key = (str(engine.url), table)
+        with self._lock:
+            if key in self._indexes:
+                return self._indexes[key]
+        indexes = reflect()
+        with self._lock:
+            self._indexes[key] = indexes
+        return indexes
+
+    def invalidate(self, engine: Engine, *tables: str) -> None:
+        with self._lock:
+            for table in tables:
+                self._columns.pop((str(engine.url), table), None)
+                self._indexes.pop((str(engine.url), table), None)
+
+
+schema_cache = SchemaCache()
+
+
+@dataclass
+class MergeCounts:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __add__(self, other: 'MergeCounts') -> 'MergeCounts':
+        return MergeCounts(self.inserted + other.inserted, self.updated + other.updated, self.unchanged + other.unchanged)
+
 
 class TableIngestor(ABC):
+    dump_format: ClassVar[str]
+
     def __init__(
         self,
         engine: Engine,
@@ -21,6 +103,11 @@ class TableIngestor(ABC):
         primary_keys: list[str],
         range_column: str,
         temp_schema: str | None = None,
+        index_range_column: bool = False,
+        batch_id: str | None = None,
+        merge_batch_size: int | None = None,
+        detect_changes: bool = False,
+        load_type: str = LoadType.INCREMENTAL,
     ):
         self.engine = engine
         self.table = table
@@ -29,12 +116,24 @@ class TableIngestor(ABC):
         self.load_timestamp = load_timestamp
         self.primary_keys = primary_keys
         self.range_column = range_column
+        self.index_range_column = index_range_column
+        self.batch_id = batch_id
+        self.merge_batch_size = merge_batch_size
+        self.detect_changes = detect_changes
+        self.load_type = load_type
+        self.merge_counts: MergeCounts | None = None
 
     def execute(self, dump_path: str) -> None:
         log.info(f'Ingesting dump from {dump_path} to {self.table}')
+        # Jobs may have recreated the temp table since the last run
+        self._schema_changed(self.temp_table)
         self._ingest_dump_to_temp_table(dump_path)
         log.info(f'Data ingested to temporary table {self.temp_table}')
-        self._copy_from_temp_to_destination_table()
+        if self.load_type == LoadType.FULL_REFRESH:
+            self._swap_in_temp_table()
+            log.info(f'Replaced {self.table} with the data from temporary table {self.temp_table}')
+            return
+        self._copy_from_temp_to_destination_table(dump_path)
         log.info(f'Data copied from temporary table {self.temp_table} to {self.table}')
 
     def _ingest_dump_to_temp_table(self, dump_path: str) -> None:
@@ -42,57 +141,395 @@ class TableIngestor(ABC):
         statements = [
             text(f'DROP TABLE IF EXISTS {self.temp_table}'),
             *ingest_stmts,
-            text(f'ALTER TABLE {self.temp_table} ADD load_timestamp TIMESTAMP NULL'),
-            text(f"UPDATE {self.temp_table} SET load_timestamp = '{self.load_timestamp.isoformat()}'"),
             text('COMMIT;'),
         ]
 
         with self.engine.connect() as conn:
             for statement in statements:
                 conn.execute(statement)
+        self._schema_changed(self.temp_table)
 
     @abstractmethod
     def _ingest_to_temp_table(self, dump_path: str) -> list[TextClause]:
         pass
 
-    def _copy_from_temp_to_destination_table(self) -> None:
-        columns = ', '.join(_quote(self._get_column_names()))
+    def create_temp_table(self, df: pl.DataFrame) -> None:
+        with self.engine.connect() as conn:
+            df.write_database(self.temp_table, connection=conn, if_table_exists='replace')
+        self._schema_changed(self.temp_table)
+
+    def _copy_from_temp_to_destination_table(self, dump_path: str) -> None:
+        self._add_missing_destination_columns()
+        temp_columns = self._data_columns(self._get_column_names())
+        columns = ', '.join(_quote(temp_columns))
+        stamp_values = ', '.join(f'{value} AS {_quote(name)}' for name, (_, value) in self._stamp_columns(temp_columns).items())
+        if not self._get_columns(self.table):
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(f'CREATE TABLE IF NOT EXISTS {self.table} AS SELECT {columns}, {stamp_values} FROM {self.temp_table} WHERE 1=0')
+                )
+            self._schema_changed(self.table)
+        temp_table_has_null_keys = self._temp_table_has_null_keys()
+        self._ensure_indexes()
+        if self.merge_batch_size:
+            self._merge_in_chunks(dump_path, temp_columns, temp_table_has_null_keys)
+            return
+
+        delete_queries = [self.create_delete_query()]
+        if temp_table_has_null_keys:
+            delete_queries.append(self._create_null_key_delete_query())
         statements = [
-            text(f'CREATE TABLE IF NOT EXISTS {self.table} AS SELECT * FROM {self.temp_table} WHERE 1=0'),
-            text(self._create_delete_query()),
-            text(f"""
-                INSERT INTO {self.table} ({columns}) 
+            *self._merge_statements(temp_columns, delete_queries),
+            text(f'DROP TABLE {self.temp_table}'),
+            text('COMMIT;'),
+        ]
+        with self.engine.begin() as conn:
+            if self.detect_changes:
+                self._log_merge_counts(self._skip_unchanged_rows(conn, temp_columns, null_keys=temp_table_has_null_keys))
+            for statement in statements:
+                conn.execute(statement)
+        self._schema_changed(self.temp_table)
+
+    def _swap_in_temp_table(self) -> None:
+        # The new table is built and indexed beside the destination, then renamed into place in one transaction, so readers
+        # see either the old or the new table with its indexes and no rows are deleted by key
+        new_table = f'{self.table}_new'
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {new_table}'))
+            self._build_table(conn, new_table)
+        with self.engine.begin() as conn:
+            for statement in self._swap_statements(new_table):
+                conn.execute(text(statement))
+        self._schema_changed(self.table, self.temp_table)
+
+    def _build_table(self, conn: Connection, target: str) -> None:
+        temp_columns = self._data_columns(self._get_column_names())
+        columns = ', '.join(_quote(temp_columns))
+        stamp_values = ', '.join(f'{value} AS {_quote(name)}' for name, (_, value) in self._stamp_columns(temp_columns).items())
+        conn.execute(text(f'CREATE TABLE {target} AS SELECT {columns}, {stamp_values} FROM {self.temp_table} WHERE 1=0'))
+        conn.execute(text(self._insert_query(target, temp_columns)))
+        conn.execute(text(f'DROP TABLE {self.temp_table}'))
+        # Indexes are built once the data is in place, which is cheaper than maintaining them row by row. The rows are
+        # deduplicated by key, so the key index can always be unique.
+        conn.execute(text(f'CREATE UNIQUE INDEX {self._index_name("key", target)} ON {target} ({", ".join(_quote(self.primary_keys))})'))
+        if self.index_range_column:
+            conn.execute(text(f'CREATE INDEX {self._index_name(self.range_column, target)} ON {target} ({_quote(self.range_column)})'))
+
+    def _swap_statements(self, new_table: str) -> list[str]:
+        # Index names are unique per schema, so the new table's indexes only take over the destination's names once the
+        # old table is dropped
+        schema, table_name = _schema_and_table(self.table)
+        index_schema = f'{schema}.' if schema else ''
+        suffixes = ['key', self.range_column] if self.index_range_column else ['key']
+        return [
+            f'DROP TABLE IF EXISTS {self.table}',
+            f'ALTER TABLE {new_table} RENAME TO {_quote(table_name)}',
+            *[
+                f'ALTER INDEX {index_schema}{self._index_name(suffix, new_table)} RENAME TO {self._index_name(suffix)}'
+                for suffix in suffixes
+            ],
+        ]
+
+    def _merge_statements(self, temp_columns: list[str], delete_queries: list[str], condition: str = 'TRUE') -> list[TextClause]:
+        return [
+            *[text(query) for query in delete_queries],
+            text(self._insert_query(self.table, temp_columns, condition)),
+        ]
+
+    def _insert_query(self, target: str, temp_columns: list[str], condition: str = 'TRUE') -> str:
+        stamps = self._stamp_columns(temp_columns)
+        columns = ', '.join(_quote(temp_columns))
+        stamp_values = ', '.join(f'{value} AS {_quote(name)}' for name, (_, value) in stamps.items())
+        return f"""
+                INSERT INTO {target} ({', '.join(_quote([*temp_columns, *stamps]))}) 
                     WITH numbered_duplicates AS (
                         SELECT {columns}, 
                             ROW_NUMBER() OVER (
                                 PARTITION BY {', '.join(_quote(self.primary_keys))} ORDER BY {_quote(self.range_column)} DESC
                             ) AS row_num 
                         FROM {self.temp_table}
+                        WHERE {condition}
                     )
-                    SELECT {columns} 
+                    SELECT {columns}, {stamp_values}
                     FROM numbered_duplicates 
-                    WHERE row_num = 1"""),
-            text(f'DROP TABLE {self.temp_table}'),
-            text('COMMIT;'),
-        ]
+                    WHERE row_num = 1"""
+
+    def _merge_in_chunks(self, dump_path: str, temp_columns: list[str], temp_table_has_null_keys: bool) -> None:
+        # Each chunk of merge_batch_size keys is deleted, inserted and recorded in the progress table in its own transaction,
+        # so a failed run re-ingesting the same dump resumes after the last committed chunk
+        fingerprint = _dump_fingerprint(dump_path)
+        chunks = self._chunk_conditions(temp_table_has_null_keys)
+        progress = {'table_name': self.table, 'dump_fingerprint': fingerprint}
         with self.engine.begin() as conn:
-            for statement in statements:
-                conn.execute(statement)
+            conn.execute(
+                text(f"""
+                CREATE TABLE IF NOT EXISTS {self._progress_table} (
+                    table_name VARCHAR, dump_fingerprint VARCHAR, chunk INTEGER, committed_at TIMESTAMP
+                )""")
+            )
+            last_chunk = conn.execute(
+                text(f"""
+                SELECT MAX(chunk) FROM {self._progress_table}
+                WHERE table_name = :table_name AND dump_fingerprint = :dump_fingerprint"""),
+                progress,
+            ).scalar()
+        first_chunk = 0 if last_chunk is None else last_chunk + 1
+        if first_chunk:
+            log.info(f'Resuming merge into {self.table} at chunk {first_chunk + 1}/{len(chunks)}')
+
+        merge_counts = MergeCounts()
+        for chunk, (condition, params, null_keys) in enumerate(chunks[first_chunk:], start=first_chunk):
+            delete_queries = [self._create_null_key_delete_query() if null_keys else self.create_delete_query(condition)]
+            with self.engine.begin() as conn:
+                if self.detect_changes:
+                    merge_counts += self._skip_unchanged_rows(conn, temp_columns, condition, params, null_keys)
+                for statement in self._merge_statements(temp_columns, delete_queries, condition):
+                    conn.execute(_bind(statement, params))
+                conn.execute(
+                    text(f'INSERT INTO {self._progress_table} VALUES (:table_name, :dump_fingerprint, :chunk, CURRENT_TIMESTAMP)'),
+                    progress | {'chunk': chunk},
+                )
+            log.info(f'Merged chunk {chunk + 1}/{len(chunks)} into {self.table}')
+
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DELETE FROM {self._progress_table} WHERE table_name = :table_name'), progress)
+            conn.execute(text(f'DROP TABLE {self.temp_table}'))
+        self._schema_changed(self.temp_table)
+        if self.detect_changes:
+            self._log_merge_counts(merge_counts)
+
+    def _skip_unchanged_rows(
+        self, conn: Connection, temp_columns: list[str], condition: str = 'TRUE', params: dict | None = None, null_keys: bool = False
+    ) -> MergeCounts:
+        # Keys whose latest row hashes the same as the stored row are dropped from the temp table, so the merge only
+        # deletes and inserts new or changed keys. With NULL key parts the keys are matched the way the merge deletes them.
+        latest = self._latest_row_hashes(self.temp_table, temp_columns, condition)
+        merge_counts = self._count_changes(conn, latest, params or {}, null_keys)
+        unchanged = text(f"""
+            DELETE FROM {self.temp_table} AS src
+            WHERE EXISTS (
+                SELECT 1 FROM ({latest}) AS latest
+                JOIN {self.table} AS dest
+                    ON {self._same_key('dest', 'latest', null_keys)} AND dest.{_quote(ROW_HASH_COLUMN)} = latest.row_hash
+                WHERE {self._same_key('src', 'latest', null_keys)}
+            )""")
+        conn.execute(_bind(unchanged, params or {}))
+        return merge_counts
+
+    def _latest_row_hashes(self, source: str, columns: list[str], condition: str = 'TRUE') -> str:
+        keys = ', '.join(_quote(self.primary_keys))
+        return f"""
+            SELECT {keys}, {self._row_hash(columns)} AS row_hash
+            FROM (
+                SELECT {', '.join(_quote(columns))},
+                    ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {_quote(self.range_column)} DESC) AS row_num
+                FROM {source}
+                WHERE {condition}
+            ) AS numbered_duplicates
+            WHERE row_num = 1"""
+
+    def _count_changes(self, conn: Connection, latest: str, params: dict, null_keys: bool = False) -> MergeCounts:
+        # Matches are counted on a marker column, since a matched key may itself be NULL
+        query = text(f"""
+            SELECT
+                COUNT(*),
+                COUNT(dest.matched),
+                SUM(CASE WHEN dest.{_quote(ROW_HASH_COLUMN)} = latest.row_hash THEN 1 ELSE 0 END)
+            FROM ({latest}) AS latest
+            LEFT JOIN (
+                SELECT {', '.join(_quote(self.primary_keys))}, {_quote(ROW_HASH_COLUMN)}, 1 AS matched FROM {self.table}
+            ) AS dest ON {self._same_key('dest', 'latest', null_keys)}""")
+        total, existing, unchanged = conn.execute(_bind(query, params)).one()
+        return MergeCounts(inserted=total - existing, updated=existing - (unchanged or 0), unchanged=unchanged or 0)
+
+    def _same_key(self, left: str, right: str, null_keys: bool = False) -> str:
+        # NULL-safe comparison keeps the planner from hash joining, so it is only used where keys may be NULL
+        operator = 'IS NOT DISTINCT FROM' if null_keys else '='
+        return ' AND '.join(f'{left}.{key} {operator} {right}.{key}' for key in _quote(self.primary_keys))
+
+    def _row_hash(self, columns: list[str]) -> str:
+        # Each value is prefixed with its length and NULL becomes a bare 'N', which no length prefix starts with, so the
+        # hashed string can only be read back one way: ('a|b', 'c') and ('a', 'b|c') or NULL and '\N' no longer collide
+        values = ' || '.join(
+            f"COALESCE(CAST(LENGTH(CAST({column} AS VARCHAR)) AS VARCHAR) || ':' || CAST({column} AS VARCHAR), 'N')"
+            for column in _quote(columns)
+        )
+        return f'md5({values})'
+
+    def _log_merge_counts(self, merge_counts: MergeCounts) -> None:
+        self.merge_counts = merge_counts
+        log.info(f'{self.table}: {merge_counts.inserted} rows inserted, {merge_counts.updated} updated, {merge_counts.unchanged} unchanged')
+
+    def _chunk_conditions(self, temp_table_has_null_keys: bool) -> list[tuple[str, dict, bool]]:
+        # Chunks are consecutive ranges of the composite key, compared as row values so every key lands in exactly one chunk
+        keys = ', '.join(_quote(self.primary_keys))
+        not_null = ' AND '.join(f'{key} IS NOT NULL' for key in _quote(self.primary_keys))
+        query = f"""
+            SELECT {keys} FROM (
+                SELECT {keys}, ROW_NUMBER() OVER (ORDER BY {keys}) AS key_num
+                FROM (SELECT DISTINCT {keys} FROM {self.temp_table} WHERE {not_null}) AS distinct_keys
+            ) AS numbered_keys
+            WHERE (key_num - 1) % {self.merge_batch_size} = 0
+            ORDER BY {keys}"""
+        with self.engine.connect() as conn:
+            boundaries = [tuple(row) for row in conn.execute(text(query))]
+
+        chunks = []
+        for i, lower in enumerate(boundaries):
+            params = {f'lower_{j}': value for j, value in enumerate(lower)}
+            condition = f'({keys}) >= ({", ".join(f":lower_{j}" for j in range(len(lower)))})'
+            if i + 1 < len(boundaries):
+                params |= {f'upper_{j}': value for j, value in enumerate(boundaries[i + 1])}
+                condition += f' AND ({keys}) < ({", ".join(f":upper_{j}" for j in range(len(lower)))})'
+            chunks.append((condition, params, False))
+        if temp_table_has_null_keys:
+            chunks.append((' OR '.join(f'{key} IS NULL' for key in _quote(self.primary_keys)), {}, True))
+        return chunks
+
+    @property
+    def _progress_table(self) -> str:
+        schema, _ = _schema_and_table(self.table)
+        return f'{schema}.table_ingestor_progress' if schema else 'table_ingestor_progress'
 
     def _get_column_names(self) -> list[str]:
-        schema, table_name_without_schema = _schema_and_table(self.temp_table)
+        return [col['name'] for col in self._get_columns(self.temp_table)]
+
+    def _get_columns(self, table: str) -> list[dict]:
+        return schema_cache.get_columns(self.engine, table)
+
+    def _schema_changed(self, *tables: str) -> None:
+        schema_cache.invalidate(self.engine, *tables)
+
+    def _add_missing_destination_columns(self) -> None:
+        destination_columns = {col['name'] for col in self._get_columns(self.table)}
+        if not destination_columns:
+            return
+        columns = [(col['name'], col['type'].compile(dialect=self.engine.dialect)) for col in self._get_columns(self.temp_table)]
+        stamps = self._stamp_columns(self._data_columns([name for name, _ in columns]))
+        columns += [(name, col_type) for name, (col_type, _) in stamps.items()]
+        missing_columns = [(name, col_type) for name, col_type in columns if name not in destination_columns]
+        if not missing_columns:
+            return
+        with self.engine.begin() as conn:
+            self._add_columns(conn, missing_columns)
+        self._schema_changed(self.table)
+
+    def _add_columns(self, conn: Connection, columns: list[tuple[str, str]]) -> None:
+        for name, col_type in columns:
+            log.info(f'Adding column {name} to {self.table}')
+            conn.execute(text(f'ALTER TABLE {self.table} ADD COLUMN {_quote(name)} {col_type}'))
+
+    def _stamp_columns(self, columns: list[str]) -> dict[str, tuple[str, str]]:
+        # Column name -> (type, value) added to every row in the final projection, so the temp table is never rewritten
+        stamps = {'load_timestamp': ('TIMESTAMP', f"CAST('{self.load_timestamp.isoformat()}' AS TIMESTAMP)")}
+        if self.batch_id is not None:
+            batch_id = self.batch_id.replace("'", "''")
+            stamps['batch_id'] = ('VARCHAR', f"CAST('{batch_id}' AS VARCHAR)")
+        if self.detect_changes:
+            stamps[ROW_HASH_COLUMN] = ('VARCHAR', self._row_hash(columns))
+        return stamps
+
+    def _data_columns(self, columns: list[str]) -> list[str]:
+        # Stamp columns are always computed in the projection, never read from the dump
+        return [name for name in columns if name not in self._stamp_columns(columns)]
+
+    def _ensure_indexes(self) -> None:
+        # Indexes are reflected through the schema cache, so loads into an indexed table skip the catalog entirely
+        indexed_columns = [set(columns) for columns in self._indexed_columns()]
+        missing_key_index = set(self.primary_keys) not in indexed_columns
+        missing_range_index = self.index_range_column and {self.range_column} not in indexed_columns
+        if missing_key_index:
+            self._add_key_index()
+        if missing_range_index:
+            log.info(f'Creating index on {self.table} ({self.range_column})')
+            with self.engine.begin() as conn:
+                conn.execute(text(f'CREATE INDEX {self._index_name(self.range_column)} ON {self.table} ({_quote(self.range_column)})'))
+        if missing_key_index or missing_range_index:
+            self._schema_changed(self.table)
+
+    def _add_key_index(self) -> None:
+        # A primary key makes its columns NOT NULL, so later dumps with NULL key parts would fail to insert. It is only added
+        # when the key columns are declared NOT NULL already, otherwise a unique index serves the same lookups. Tables
+        # holding duplicate keys cannot take either, so fall back to a plain index.
+        keys = ', '.join(_quote(self.primary_keys))
+        candidates = [
+            ('primary key', f'ALTER TABLE {self.table} ADD PRIMARY KEY ({keys})'),
+            ('unique index', f'CREATE UNIQUE INDEX {self._index_name("key")} ON {self.table} ({keys})'),
+            ('index', f'CREATE INDEX {self._index_name("key")} ON {self.table} ({keys})'),
+        ]
+        for kind, ddl in candidates[0 if self._keys_not_null() else 1 :]:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(ddl))
+            except DBAPIError as e:
+                log.warning(f'Could not add {kind} on {self.table} ({keys}): {e.orig}')
+                continue
+            log.info(f'Added {kind} on {self.table} ({keys})')
+            return
+
+    def _keys_not_null(self) -> bool:
+        nullable = {col['name']: col['nullable'] for col in self._get_columns(self.table)}
+        return all(nullable.get(key) is False for key in self.primary_keys)
+
+    def _indexed_columns(self) -> list[list[str]]:
+        return [columns for columns, _ in self._indexes()]
+
+    def _indexes(self) -> list[IndexColumns]:
+        return schema_cache.get_indexes(self.engine, self.table, self._reflect_indexes)
+
+    def _reflect_indexes(self) -> list[IndexColumns]:
+        schema, table_name = _schema_and_table(self.table)
         inspector = inspect(self.engine)
-        return [col['name'] for col in inspector.get_columns(table_name_without_schema, schema=schema)]
+        primary_key = inspector.get_pk_constraint(table_name, schema=schema)['constrained_columns']
+        indexes = [(index['column_names'], bool(index['unique'])) for index in inspector.get_indexes(table_name, schema=schema)]
+        return [(primary_key, True), *indexes] if primary_key else indexes
 
-    def _create_delete_query(self) -> str:
-        casted_keys = [f"COALESCE(CAST({key} AS VARCHAR), '')" for key in _quote(self.primary_keys)]
-        key_concat = " || '-' || ".join(casted_keys)
+    def _index_name(self, suffix: str, table: str | None = None) -> str:
+        _, table_name = _schema_and_table(table or self.table)
+        return f'{table_name}_{suffix}_idx'
+
+    def create_delete_query(self, condition: str = 'TRUE') -> str:
+        # Matching on the typed key columns lets the planner use a primary key or index on the destination
+        keys = ', '.join(_quote(self.primary_keys))
+        return f"""
+            DELETE FROM {self.table}
+            WHERE ({keys}) IN (
+                SELECT {keys} FROM {self.temp_table} WHERE {condition}
+            )"""
+
+    def _create_null_key_delete_query(self) -> str:
+        # Key equality never matches NULL, so rows with a NULL key part are replaced through a null-safe comparison instead.
+        # It only runs when the dump has such rows.
+        has_null_key = ' OR '.join(f'src.{key} IS NULL' for key in _quote(self.primary_keys))
+        same_key = ' AND '.join(f'dest.{key} IS NOT DISTINCT FROM src.{key}' for key in _quote(self.primary_keys))
         return f"""
-            DELETE FROM {self.table} 
-            WHERE {key_concat} IN (
-                SELECT DISTINCT {key_concat} FROM {self.temp_table}
+            DELETE FROM {self.table} AS dest
+            WHERE EXISTS (
+                SELECT 1 FROM {self.temp_table} AS src WHERE ({has_null_key}) AND {same_key}
             )"""
 
+    def _temp_table_has_null_keys(self) -> bool:
+        return self._has_null_keys(self.temp_table)
+
+    def _has_null_keys(self, source: str) -> bool:
+        has_null_key = ' OR '.join(f'{key} IS NULL' for key in _quote(self.primary_keys))
+        with self.engine.connect() as conn:
+            return conn.execute(text(f'SELECT 1 FROM {source} WHERE {has_null_key} LIMIT 1')).first() is not None
+
+
+def _dump_fingerprint(dump_path: str) -> str:
+    paths = sorted(glob.glob(f'{dump_path}/*')) if os.path.isdir(dump_path) else [dump_path]
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _bind(statement: TextClause, params: dict) -> TextClause:
+    return statement.bindparams(**{name: value for name, value in params.items() if f':{name}' in statement.text})
+
 
 def _quote(name: str | list[str]) -> str | list[str]:
     if isinstance(name, str):
@@ -106,6 +543,8 @@ def _schema_and_table(table: str) -> tuple[str | None, str]:
 
 
 class DuckDBTableIngestor(TableIngestor):
+    dump_format = DataFrameFormat.PARQUET
+
     def __init__(
         self,
         engine: Engine,
@@ -114,19 +553,158 @@ class DuckDBTableIngestor(TableIngestor):
         primary_keys: list[str],
         range_column: str,
         temp_schema: str | None = None,
+        index_range_column: bool = False,
+        batch_id: str | None = None,
+        merge_batch_size: int | None = None,
+        detect_changes: bool = False,
+        load_type: str = LoadType.INCREMENTAL,
     ):
-        super().__init__(engine, table, load_timestamp, primary_keys, range_column, temp_schema)
+        super().__init__(
+            engine,
+            table,
+            load_timestamp,
+            primary_keys,
+            range_column,
+            temp_schema,
+            index_range_column,
+            batch_id,
+            merge_batch_size,
+            detect_changes,
+            load_type,
+        )
+
+    def execute(self, dump_path: str) -> None:
+        if self.merge_batch_size or self.load_type == LoadType.FULL_REFRESH:
+            super().execute(dump_path)
+            return
+        if self._has_null_keys(self._dump_source(dump_path)):
+            # INSERT OR REPLACE never matches NULL key parts, so those rows would pile up instead of being replaced
+            log.info(f'Dump has NULL values in {self.primary_keys}, merging through {self.temp_table}')
+            super().execute(dump_path)
+            return
+        if not self._can_upsert():
+            log.info(f'{self.table} cannot be upserted by {self.primary_keys}, merging through {self.temp_table}')
+            super().execute(dump_path)
+            return
+        log.info(f'Upserting dump from {dump_path} into {self.table}')
+        self._upsert(dump_path)
+        log.info(f'Data upserted into {self.table}')
+
+    def create_temp_table(self, df: pl.DataFrame) -> None:
+        # The DataFrame is registered with DuckDB as an Arrow-backed view, so its buffers are read without DBAPI row marshalling
+        with native_duckdb_connection(self.engine) as conn:
+            conn.register('temp_table_source', df)
+            try:
+                conn.execute(f'CREATE OR REPLACE TABLE {self.temp_table} AS SELECT * FROM temp_table_source')
+            finally:
+                conn.unregister('temp_table_source')
+        self._schema_changed(self.temp_table)
+
+    def _swap_in_temp_table(self) -> None:
+        # DuckDB cannot rename a table that has indexes, so the destination is rebuilt under its own name in a single
+        # transaction instead. Readers keep seeing the old table until it commits.
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {self.table}'))
+            self._build_table(conn, self.table)
+        self._schema_changed(self.table, self.temp_table)
+
+    def _can_upsert(self) -> bool:
+        # INSERT OR REPLACE resolves conflicts through a primary key or unique index, so it is only safe when one of them
+        # matches our key. A missing table is created with a unique index on it. DuckDB silently keeps the old values of
+        # columns covered by any other index, so a range column index or any other index rules the upsert out.
+        if self.index_range_column:
+            return False
+        if not self._get_columns(self.table):
+            return True
+        indexes = self._indexes()
+        if any(set(columns) != set(self.primary_keys) for columns, _ in indexes):
+            return False
+        return any(is_unique for _, is_unique in indexes)
+
+    def _primary_key_columns(self) -> list[str]:
+        schema, table_name = _schema_and_table(self.table)
+        query = text("""
+            SELECT constraint_column_names FROM duckdb_constraints()
+            WHERE schema_name = :schema AND table_name = :table_name AND constraint_type = 'PRIMARY KEY'""")
+        with self.engine.connect() as conn:
+            row = conn.execute(query, {'schema': schema or 'main', 'table_name': table_name}).first()
+        return list(row[0]) if row else []
+
+    def _reflect_indexes(self) -> list[IndexColumns]:
+        # duckdb_engine reflects neither indexes nor composite primary keys, so read DuckDB's own catalog
+        schema, table_name = _schema_and_table(self.table)
+        query = text('SELECT expressions, is_unique FROM duckdb_indexes() WHERE schema_name = :schema AND table_name = :table_name')
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, {'schema': schema or 'main', 'table_name': table_name}).fetchall()
+        indexes = [([column.strip().strip('"') for column in row[0].strip('[]').split(',')], row[1]) for row in rows]
+        primary_key = self._primary_key_columns()
+        return [(primary_key, True), *indexes] if primary_key else indexes
+
+    def _upsert(self, dump_path: str) -> None:
+        # One pass over the dump: dedupe with QUALIFY, stamp load_timestamp in the projection and replace rows by key.
+        # With change detection, keys whose row hash matches the stored one are left untouched.
+        source = self._dump_source(dump_path)
+        destination_columns = {col['name'] for col in self._get_columns(self.table)}
+        with self.engine.begin() as conn:
+            described_columns = {row[0]: row[1] for row in conn.execute(text(f'DESCRIBE SELECT * FROM {source}'))}
+            dump_columns = {name: described_columns[name] for name in self._data_columns(list(described_columns))}
+            stamps = self._stamp_columns(list(dump_columns))
+            stamp_values = ', '.join(f'{value} AS {_quote(name)}' for name, (_, value) in stamps.items())
+            columns = dump_columns | {name: col_type for name, (col_type, _) in stamps.items()}
+            missing_columns = [(name, col_type) for name, col_type in columns.items() if name not in destination_columns]
+            if not destination_columns:
+                for statement in self._create_table_with_unique_key(columns):
+                    conn.execute(text(statement))
+            else:
+                self._add_columns(conn, missing_columns)
+            changed = 'TRUE'
+            if self.detect_changes:
+                self._log_merge_counts(self._count_changes(conn, self._latest_row_hashes(source, list(dump_columns)), {}))
+                changed = f"""NOT EXISTS (
+                    SELECT 1 FROM {self.table} AS dest
+                    WHERE {self._same_key('dest', 'latest')} AND dest.{_quote(ROW_HASH_COLUMN)} = latest.{_quote(ROW_HASH_COLUMN)}
+                )"""
+            conn.execute(
+                text(f"""
+                INSERT OR REPLACE INTO {self.table} BY NAME
+                    SELECT * FROM (
+                        SELECT {', '.join(_quote(list(dump_columns)))}, {stamp_values}
+                        FROM {source}
+                        QUALIFY ROW_NUMBER() OVER (
+                            PARTITION BY {', '.join(_quote(self.primary_keys))} ORDER BY {_quote(self.range_column)} DESC
+                        ) = 1
+                    ) AS latest
+                    WHERE {changed}""")
+            )
+            conn.execute(text(f'DROP TABLE IF EXISTS {self.temp_table}'))
+        self._schema_changed(self.temp_table)
+        if missing_columns:
+            self._schema_changed(self.table)
+        self._ensure_indexes()
+
+    def _create_table_with_unique_key(self, columns: dict[str, str]) -> list[str]:
+        # A unique index rather than a primary key: that would make the key columns NOT NULL, and a later dump with NULL
+        # key parts could then not be merged into the table at all
+        column_definitions = [f'{_quote(name)} {col_type}' for name, col_type in columns.items()]
+        return [
+            f'CREATE TABLE {self.table} ({", ".join(column_definitions)})',
+            f'CREATE UNIQUE INDEX {self._index_name("key")} ON {self.table} ({", ".join(_quote(self.primary_keys))})',
+        ]
+
+    @staticmethod
+    def _dump_source(dump_path: str) -> str:
+        return f"read_parquet(['{dump_path}/*.parquet'])"
 
     def _ingest_to_temp_table(self, dump_path: str) -> list[TextClause]:
         return [
             text(f"""
                     CREATE TABLE {self.temp_table} 
-                    AS FROM read_parquet(['{dump_path}/*.parquet']);
+                    AS FROM {self._dump_source(dump_path)};
             """),
         ]
 
 
-# This class requires to create a temporary table in the database before running the execute command
+# The staging table is created UNLOGGED from the dump's schema, or from the temp table a job created beforehand
 class PostgresTableIngestor(TableIngestor):
     def __init__(
         self,
@@ -136,15 +714,43 @@ class PostgresTableIngestor(TableIngestor):
         primary_keys: list[str],
         range_column: str,
         temp_schema: str | None = None,
+        index_range_column: bool = False,
+        batch_id: str | None = None,
+        merge_batch_size: int | None = None,
+        detect_changes: bool = False,
+        load_type: str = LoadType.INCREMENTAL,
+        copy_mode: str = PostgresCopyMode.SERVER_FILE,
+        load_parallelism: int = 1,
     ):
-        super().__init__(engine, table, load_timestamp, primary_keys, range_column, temp_schema)
+        super().__init__(
+            engine,
+            table,
+            load_timestamp,
+            primary_keys,
+            range_column,
+            temp_schema,
+            index_range_column,
+            batch_id,
+            merge_batch_size,
+            detect_changes,
+            load_type,
+        )
+        self.copy_mode = copy_mode
+        self.load_parallelism = load_parallelism
+
+    @property
+    def dump_format(self) -> str:
+        return DataFrameFormat.PARQUET if self.copy_mode == PostgresCopyMode.BINARY_STDIN else DataFrameFormat.CSV
 
     def _ingest_dump_to_temp_table(self, dump_path: str) -> None:
-        ingest_stmts = self._ingest_to_temp_table(dump_path)
+        column_types = self._create_staging_table(dump_path)
+        if self.copy_mode == PostgresCopyMode.BINARY_STDIN:
+            self._copy_from_stdin(dump_path, column_types)
+            ingest_stmts = []
+        else:
+            ingest_stmts = self._ingest_to_temp_table(dump_path)
         statements = [
             *ingest_stmts,
-            text(f'ALTER TABLE {self.temp_table} ADD load_timestamp TIMESTAMP NULL'),
-            text(f"UPDATE {self.temp_table} SET load_timestamp = '{self.load_timestamp.isoformat()}'"),
             text('COMMIT;'),
         ]
 
@@ -155,6 +761,62 @@ class PostgresTableIngestor(TableIngestor):
     def _ingest_to_temp_table(self, dump_path: str) -> list[TextClause]:
         return [text(f"COPY {self.temp_table} FROM '{dump_path}' DELIMITER '|' CSV HEADER;")]
 
+    def _create_staging_table(self, dump_path: str) -> dict[str, str]:
+        # The staging rows are reloaded from the dump on every run, so they skip the WAL and only the final merge is logged
+        column_types = self._staging_column_types(dump_path)
+        columns = ', '.join(f'{_quote(name)} {col_type}' for name, col_type in column_types.items())
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {self.temp_table}'))
+            conn.execute(text(f'CREATE UNLOGGED TABLE {self.temp_table} ({columns})'))
+        self._schema_changed(self.temp_table)
+        return column_types
+
+    def _staging_column_types(self, dump_path: str) -> dict[str, str]:
+        temp_table_types = {col['name']: col['type'].compile(dialect=self.engine.dialect) for col in self._get_columns(self.temp_table)}
+        if self.dump_format == DataFrameFormat.PARQUET:
+            dump_schema = pl.Schema(pl.read_parquet_schema(sorted(glob.glob(f'{dump_path}/*.parquet'))[0]))
+        else:
+            dump_schema = pl.scan_csv(dump_path, separator='|', try_parse_dates=True).collect_schema()
+        return {name: temp_table_types.get(name, col_type) for name, col_type in postgres_column_types(dump_schema).items()}
+
+    def _copy_from_stdin(self, dump_path: str, column_types: dict[str, str]) -> None:
+        # Row groups are dealt out to load_parallelism shards, each streamed over its own pooled connection
+        shards = _shard_row_groups(sorted(glob.glob(f'{dump_path}/*.parquet')), self.load_parallelism)
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix='pg-copy') as executor:
+            shard_stats = list(executor.map(partial(self._copy_shard, column_types=column_types), shards))
+        stats = CopyStats(
+            rows=sum(shard.rows for shard in shard_stats),
+            bytes=sum(shard.bytes for shard in shard_stats),
+            seconds=time.perf_counter() - started_at,
+        )
+        log.info(
+            f'Copied {stats.rows} rows ({stats.bytes} bytes) to {self.temp_table} over {len(shards)} connections '
+            f'in {stats.seconds:.1f}s: {stats.rows_per_second:.0f} rows/s, {stats.mb_per_second:.1f} MB/s'
+        )
+
+    def _copy_shard(self, row_groups: dict[str, list[int]], column_types: dict[str, str]) -> CopyStats:
+        batches = (
+            pl.from_arrow(batch)
+            for parquet_file, file_row_groups in row_groups.items()
+            for batch in pq.ParquetFile(parquet_file).iter_batches(batch_size=COPY_BATCH_SIZE, row_groups=file_row_groups)
+        )
+        connection = self.engine.raw_connection()
+        try:
+            stats = copy_binary(connection, self.temp_table, column_types, batches)
+            connection.commit()
+        finally:
+            connection.close()
+        return stats
+
+
+def _shard_row_groups(parquet_files: list[str], shards: int) -> list[dict[str, list[int]]]:
+    row_groups = [(path, row_group) for path in parquet_files for row_group in range(pq.ParquetFile(path).num_row_groups)]
+    sharded: list[dict[str, list[int]]] = [{} for _ in range(max(1, min(shards, len(row_groups))))]
+    for i, (path, row_group) in enumerate(row_groups):
+        sharded[i % len(sharded)].setdefault(path, []).append(row_group)
+    return sharded
+
 
 class TableIngestorFactory:
     _ingestor_map: ClassVar[dict[ConnectionType, type[TableIngestor]]] = {
@@ -171,11 +833,19 @@ class TableIngestorFactory:
         primary_keys: list[str],
         range_column: str,
         temp_schema: str | None = None,
+        index_range_column: bool = False,
+        batch_id: str | None = None,
+        merge_batch_size: int | None = None,
+        detect_changes: bool = False,
+        load_type: str = LoadType.INCREMENTAL,
+        copy_mode: str = PostgresCopyMode.SERVER_FILE,
+        load_parallelism: int = 1,
     ) -> 'TableIngestor':
         try:
             ingestor_cls = TableIngestorFactory._ingestor_map[conn_type]
         except KeyError as err:
             raise ValueError(f'Unsupported connection type: {conn_type}') from err
+        options = {'copy_mode': copy_mode, 'load_parallelism': load_parallelism} if ingestor_cls is PostgresTableIngestor else {}
         return ingestor_cls(
             engine=engine,
             table=table,
@@ -183,4 +853,10 @@ class TableIngestorFactory:
             primary_keys=primary_keys,
             range_column=range_column,
             temp_schema=temp_schema,
+            index_range_column=index_range_column,
+            batch_id=batch_id,
+            merge_batch_size=merge_batch_size,
+            detect_changes=detect_changes,
+            load_type=load_type,
+            **options,
         )
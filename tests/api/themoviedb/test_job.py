@@ -0,0 +1,143 @@
+import threading
+from datetime import UTC, datetime
+
+import polars as pl
+import pytest
+import sqlalchemy as sa
+
+from api.themoviedb.job import MOVIES_SCHEMA, JobMetadata, TMDBJob, run_jobs, transform_movies
+from util.config import InMemoryBookmarkUpdater
+from util.connection_factory import ConnectionFactory
+from util.table_copier import TableIngestorFactory
+
+MOVIES_TABLE = 'themovie_db.movies'
+
+
+def movie(movie_id: int, title: str, release_date: str = '2024-01-01', vote_count: int = 10) -> dict:
+    return {'id': movie_id, 'title': title, 'genre_ids': [12, 28], 'release_date': release_date, 'overview': None, 'vote_count': vote_count}
+
+
+class FakeTMDBApi:
+    def __init__(self, pages: list[list[dict]]):
+        self.pages = pages
+        self.detail_ids: list[int] = []
+
+    def fetch_movies(self, _bookmark: datetime, max_pages: int, start_page: int = 1, **_kwargs) -> list[dict]:
+        return [row for page in self.pages[start_page - 1 : max_pages] for row in page]
+
+    def iter_movies(self, _bookmark: datetime, max_pages: int, start_page: int = 1, **_kwargs):
+        yield from self.pages[start_page - 1 : max_pages]
+
+    def clear_checkpoint(self, endpoint: str) -> None:
+        self.cleared_endpoint = endpoint
+
+    def fetch_details(self, _endpoint_template: str, ids: list[int]) -> list[dict]:
+        self.detail_ids.extend(ids)
+        return [{'id': i, 'runtime': i * 10, 'credits': {'cast': [{'name': f'actor-{i}'}], 'crew': []}} for i in ids]
+
+
+@pytest.fixture
+def duckdb_engine(tmp_path):
+    connection = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+    with connection.get_sqlalchemy_engine() as engine:
+        with engine.begin() as conn:
+            conn.execute(sa.text('CREATE SCHEMA themovie_db'))
+        yield connection, engine
+
+
+def run_job(duckdb_engine, tmp_path, tmdb_api: FakeTMDBApi, streaming: bool, enrich_details: bool = False) -> InMemoryBookmarkUpdater:
+    connection, engine = duckdb_engine
+    bookmark_updater = InMemoryBookmarkUpdater()
+    table_ingestor = TableIngestorFactory.from_connection_type(
+        conn_type=connection.type,
+        engine=engine,
+        table=MOVIES_TABLE,
+        load_timestamp=datetime.now(UTC),
+        primary_keys=['id'],
+        range_column='release_date',
+    )
+    TMDBJob(
+        metadata=JobMetadata(table_name=MOVIES_TABLE, is_active=True, primary_keys=['id']),
+        tmdb_api=tmdb_api,
+        table_ingestor=table_ingestor,
+        temp_dir=str(tmp_path),
+        bookmark=datetime(2024, 1, 1, tzinfo=UTC),
+        update_bookmark=bookmark_updater.update,
+        streaming=streaming,
+        row_group_size=2,
+        enrich_details=enrich_details,
+    ).run()
+    return bookmark_updater
+
+
+def read_movies(engine) -> pl.DataFrame:
+    with engine.connect() as conn:
+        return pl.read_database(f'SELECT id, title, genre_ids, release_date FROM {MOVIES_TABLE} ORDER BY id', connection=conn)
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_tmdb_job_loads_movies(duckdb_engine, tmp_path, streaming: bool):
+    pages = [[movie(1, 'a'), movie(2, 'b')], [movie(3, 'c')], [movie(2, 'b2', '2024-02-01')]]
+
+    bookmark_updater = run_job(duckdb_engine, tmp_path, FakeTMDBApi(pages), streaming)
+
+    df = read_movies(duckdb_engine[1])
+    assert df['id'].to_list() == [1, 2, 3]
+    assert df['title'].to_list() == ['a', 'b2', 'c']
+    assert df['genre_ids'].to_list() == ['12,28'] * 3
+    assert bookmark_updater.bookmark is not None
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_tmdb_job_enriches_only_new_or_changed_movies(duckdb_engine, tmp_path, streaming: bool):
+    run_job(duckdb_engine, tmp_path, FakeTMDBApi([[movie(1, 'a'), movie(2, 'b')]]), streaming, enrich_details=True)
+
+    tmdb_api = FakeTMDBApi([[movie(1, 'a'), movie(2, 'b', vote_count=11), movie(3, 'c')]])
+    run_job(duckdb_engine, tmp_path, tmdb_api, streaming, enrich_details=True)
+
+    assert sorted(tmdb_api.detail_ids) == [2, 3]
+    with duckdb_engine[1].connect() as conn:
+        df = pl.read_database(f'SELECT id, runtime, top_cast FROM {MOVIES_TABLE} ORDER BY id', connection=conn)
+    assert df['runtime'].to_list() == [10, 20, 30]
+    assert df['top_cast'].to_list() == ['actor-1', 'actor-2', 'actor-3']
+
+
+def test_tmdb_job_adds_detail_columns_to_existing_table(duckdb_engine, tmp_path):
+    run_job(duckdb_engine, tmp_path, FakeTMDBApi([[movie(1, 'a')]]), streaming=False)
+
+    run_job(duckdb_engine, tmp_path, FakeTMDBApi([[movie(2, 'b')]]), streaming=False, enrich_details=True)
+
+    with duckdb_engine[1].connect() as conn:
+        df = pl.read_database(f'SELECT id, runtime FROM {MOVIES_TABLE} ORDER BY id', connection=conn)
+    assert df['runtime'].to_list() == [None, 20]
+
+
+def test_transform_movies_keeps_declared_types_for_null_pages():
+    page = [movie(1, 'a', release_date='') | {'unknown_field': 1}]
+
+    df = transform_movies(pl.from_dicts(page, schema=MOVIES_SCHEMA))
+
+    assert df.schema['overview'] == pl.Utf8
+    assert df.schema['release_date'] == pl.Date
+    assert df.schema['popularity'] == pl.Float64
+    assert df.row(0, named=True)['genre_ids'] == '12,28'
+    assert df.row(0, named=True)['release_date'] is None
+    assert 'unknown_field' not in df.columns
+
+
+class BarrierJob:
+    def __init__(self, table_name: str, barrier: threading.Barrier):
+        self.metadata = JobMetadata(table_name=table_name, is_active=True, primary_keys=['id'])
+        self.barrier = barrier
+
+    def run(self) -> None:
+        self.barrier.wait(timeout=5)
+
+
+def test_run_jobs_runs_tables_concurrently():
+    barrier = threading.Barrier(2)
+    jobs = [BarrierJob('themovie_db.movies', barrier), BarrierJob('themovie_db.tv_shows', barrier)]
+
+    timings = run_jobs(jobs, max_parallel_tables=2)
+
+    assert set(timings) == {'themovie_db.movies', 'themovie_db.tv_shows'}
@@ -0,0 +1,65 @@
+from api.themoviedb.rate_limiter import DEFAULT_RETRY_AFTER, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_rate_limiter_allows_burst_up_to_capacity():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests=4, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    for _ in range(4):
+        limiter.acquire()
+
+    assert clock.now == 0
+    assert limiter.slept_seconds == 0
+
+
+def test_rate_limiter_paces_requests_after_burst():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests=4, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    for _ in range(8):
+        limiter.acquire()
+
+    assert clock.now == 1.0
+    assert limiter.slept_seconds == 1.0
+
+
+def test_rate_limiter_respects_retry_after():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests=4, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    limiter.update_from_headers({'Retry-After': '3'})
+    limiter.acquire()
+
+    assert clock.now >= 3
+
+
+def test_rate_limiter_throttle_without_retry_after_pauses_for_default():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests=4, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    limiter.throttle({})
+    limiter.acquire()
+
+    assert clock.now >= DEFAULT_RETRY_AFTER
+
+
+def test_rate_limiter_shrinks_budget_to_remaining_header():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests=4, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    limiter.update_from_headers({'X-RateLimit-Remaining': '1'})
+    limiter.acquire()
+    limiter.acquire()
+
+    assert clock.now == 0.25
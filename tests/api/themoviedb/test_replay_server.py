@@ -0,0 +1,34 @@
+from api.themoviedb.checkpoint import CheckpointStore
+from api.themoviedb.rate_limiter import RateLimiter
+from api.themoviedb.replay_server import ReplayServer
+from api.themoviedb.themoviedb import MOVIES_ENDPOINT, TMDBApi
+
+
+def test_replay_server_serves_all_pages_through_tmdb_api(tmp_path):
+    with ReplayServer(total_pages=4) as server, TMDBApi('key', str(tmp_path), max_workers=2, base_url=server.base_url) as tmdb_api:
+        results = tmdb_api.fetch_api_data(MOVIES_ENDPOINT, 10, {})
+
+    assert [result['id'] for result in results] == list(range(20, 100))
+    assert server.served_pages == 4
+
+
+def test_replay_server_replays_checkpoint_directory(tmp_path):
+    checkpoint = CheckpointStore(f'{tmp_path}/checkpoints').for_query(MOVIES_ENDPOINT, {'sort_by': 'popularity.desc'})
+    checkpoint.save_page(1, {'page': 1, 'results': [{'id': 7}], 'total_pages': 1, 'total_results': 1})
+
+    with ReplayServer(recordings_dir=f'{tmp_path}/checkpoints') as server:
+        with TMDBApi('key', str(tmp_path), base_url=server.base_url) as tmdb_api:
+            results = tmdb_api.fetch_api_data(MOVIES_ENDPOINT, 10, {})
+
+    assert results == [{'id': 7}]
+
+
+def test_replay_server_rate_limits_reach_the_shared_rate_limiter(tmp_path):
+    rate_limiter = RateLimiter(max_requests=100, per_seconds=1)
+    with ReplayServer(total_pages=3, rate_limit_ratio=0.5, retry_after=0) as server:
+        with TMDBApi('key', str(tmp_path), rate_limiter=rate_limiter, base_url=server.base_url) as tmdb_api:
+            results = tmdb_api.fetch_api_data(MOVIES_ENDPOINT, 3, {})
+
+    assert len(results) == 60
+    assert server.rate_limited_requests > 0
+    assert server.served_requests == server.served_pages + server.rate_limited_requests
@@ -0,0 +1,50 @@
+import os
+
+from api.themoviedb.response_cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+def test_response_cache_expires_entries_after_ttl(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(str(tmp_path), ttl_seconds=10, clock=clock.time)
+    cache.store('discover/movie', {'page': 1}, {'results': [1]}, '"etag-1"')
+
+    assert cache.lookup('discover/movie', {'page': 1}).fresh
+    assert cache.lookup('discover/movie', {'page': 2}) is None
+
+    clock.now += 11
+    stale = cache.lookup('discover/movie', {'page': 1})
+    assert not stale.fresh
+    assert stale.etag == '"etag-1"'
+
+    cache.refresh('discover/movie', {'page': 1}, stale)
+    assert cache.lookup('discover/movie', {'page': 1}).fresh
+    assert cache.stats() | {'size_bytes': 0} == {'hits': 2, 'revalidated': 1, 'misses': 1, 'size_bytes': 0}
+
+
+def test_response_cache_evicts_least_recently_used_entries(tmp_path):
+    clock = FakeClock()
+    body = {'results': ['x' * 100]}
+    cache = ResponseCache(str(tmp_path), ttl_seconds=3600, clock=clock.time)
+    cache.store('discover/movie', {'page': 1}, body, None)
+    entry_size = cache.stats()['size_bytes']
+    cache = ResponseCache(str(tmp_path), ttl_seconds=3600, max_bytes=entry_size * 2, clock=clock.time)
+
+    clock.now += 1
+    cache.store('discover/movie', {'page': 2}, body, None)
+    clock.now += 1
+    cache.lookup('discover/movie', {'page': 1})
+    clock.now += 1
+    cache.store('discover/movie', {'page': 3}, body, None)
+
+    assert cache.lookup('discover/movie', {'page': 1}) is not None
+    assert cache.lookup('discover/movie', {'page': 2}) is None
+    assert cache.lookup('discover/movie', {'page': 3}) is not None
+    assert len(os.listdir(tmp_path)) == 2
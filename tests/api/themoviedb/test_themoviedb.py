@@ -0,0 +1,226 @@
+import random
+import time
+from datetime import UTC, date, datetime, timedelta
+from http import HTTPStatus
+
+import pytest
+
+from api.themoviedb import themoviedb
+from api.themoviedb.checkpoint import CheckpointStore
+from api.themoviedb.rate_limiter import DEFAULT_RETRY_AFTER, RateLimiter
+from api.themoviedb.response_cache import ResponseCache
+from api.themoviedb.themoviedb import MOVIES_DATE_PARAMS, TMDBApi
+
+TOTAL_PAGES = 5
+PAGE_SIZE = 3
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, payload: dict | None = None, headers: dict | None = None):
+        self.status_code = status_code
+        self.payload = payload or {}
+        self.headers = headers or {}
+        self.text = str(payload)
+
+    def json(self) -> dict:
+        return self.payload
+
+
+class FakeSession:
+    def __init__(self, rate_limited_pages: set[int] | None = None, failing_pages: set[int] | None = None):
+        self.requested_pages: list[int] = []
+        self.rate_limited_pages = set(rate_limited_pages or ())
+        self.failing_pages = set(failing_pages or ())
+
+    def get(self, _url: str, params: dict, headers: dict | None = None) -> FakeResponse:
+        page = params['page']
+        self.requested_pages.append(page)
+        if headers and headers.get('If-None-Match') == f'"page-{page}"':
+            return FakeResponse(HTTPStatus.NOT_MODIFIED)
+        if page in self.failing_pages:
+            return FakeResponse(HTTPStatus.INTERNAL_SERVER_ERROR, {'status_message': 'boom'})
+        if page in self.rate_limited_pages:
+            self.rate_limited_pages.remove(page)
+            return FakeResponse(HTTPStatus.TOO_MANY_REQUESTS, headers={'Retry-After': '0'})
+        time.sleep(random.uniform(0, 0.01))
+        results = [{'id': page * 100 + i} for i in range(PAGE_SIZE)]
+        return FakeResponse(HTTPStatus.OK, {'page': page, 'results': results, 'total_pages': TOTAL_PAGES}, {'ETag': f'"page-{page}"'})
+
+    def close(self) -> None:
+        pass
+
+
+class RateLimitedSession(FakeSession):
+    # Answers every request with a 429 that carries no Retry-After header
+    def get(self, _url: str, params: dict, **_kwargs) -> FakeResponse:
+        self.requested_pages.append(params['page'])
+        return FakeResponse(HTTPStatus.TOO_MANY_REQUESTS)
+
+
+class DatedFakeSession(FakeSession):
+    def __init__(self, movies: list[dict]):
+        super().__init__()
+        self.movies = movies
+
+    def get(self, _url: str, params: dict, **_kwargs) -> FakeResponse:
+        page = params['page']
+        self.requested_pages.append(page)
+        start, end = params.get('release_date.gte', '0000-00-00'), params.get('release_date.lte', '9999-99-99')
+        matches = [m for m in self.movies if any(start <= d <= end for d in m['release_dates'])]
+        page_size = themoviedb.DISCOVER_PAGE_SIZE
+        total_pages = (len(matches) + page_size - 1) // page_size
+        if page > themoviedb.MAX_DISCOVER_PAGES:
+            return FakeResponse(HTTPStatus.BAD_REQUEST, {'status_message': 'page must be less than or equal to 500'})
+        results = [{'id': m['id']} for m in matches[(page - 1) * page_size : page * page_size]]
+        return FakeResponse(HTTPStatus.OK, {'page': page, 'results': results, 'total_pages': total_pages, 'total_results': len(matches)})
+
+
+def expected_ids(last_page: int = TOTAL_PAGES) -> list[int]:
+    return [page * 100 + i for page in range(1, last_page + 1) for i in range(PAGE_SIZE)]
+
+
+@pytest.fixture
+def tmdb_api(tmp_path) -> TMDBApi:
+    def build(
+        max_workers: int,
+        session: FakeSession,
+        checkpoint_store: CheckpointStore | None = None,
+        response_cache: ResponseCache | None = None,
+    ) -> TMDBApi:
+        rate_limiter = RateLimiter(max_requests=100, per_seconds=1)
+        api = TMDBApi(
+            'token',
+            str(tmp_path),
+            max_workers=max_workers,
+            rate_limiter=rate_limiter,
+            checkpoint_store=checkpoint_store,
+            response_cache=response_cache,
+        )
+        api.session = session
+        return api
+
+    return build
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_fetch_api_data_returns_results_in_page_order(tmdb_api, max_workers: int):
+    api = tmdb_api(max_workers, FakeSession())
+
+    data = api.fetch_api_data('discover/movie', max_pages=0, params={})
+
+    assert [row['id'] for row in data] == expected_ids()
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_fetch_api_data_stops_at_max_pages(tmdb_api, max_workers: int):
+    session = FakeSession()
+    api = tmdb_api(max_workers, session)
+
+    data = api.fetch_api_data('discover/movie', max_pages=3, params={})
+
+    assert [row['id'] for row in data] == expected_ids(last_page=3)
+    assert sorted(session.requested_pages) == [1, 2, 3]
+
+
+def test_fetch_api_data_retries_rate_limited_pages(tmdb_api):
+    session = FakeSession(rate_limited_pages={2, 4})
+    api = tmdb_api(4, session)
+
+    data = api.fetch_api_data('discover/movie', max_pages=0, params={})
+
+    assert [row['id'] for row in data] == expected_ids()
+    assert api.request_count == TOTAL_PAGES + 2
+
+
+def test_rate_limited_request_without_retry_after_pauses_and_gives_up(tmdb_api):
+    clock = FakeClock()
+    session = RateLimitedSession()
+    api = tmdb_api(1, session)
+    api.rate_limiter = RateLimiter(max_requests=100, per_seconds=1, clock=clock.time, sleep=clock.sleep)
+
+    with pytest.raises(Exception, match='still rate limited'):
+        api.fetch_api_data('discover/movie', max_pages=0, params={})
+
+    assert len(session.requested_pages) == themoviedb.MAX_RATE_LIMITED_ATTEMPTS
+    assert clock.now >= (themoviedb.MAX_RATE_LIMITED_ATTEMPTS - 1) * DEFAULT_RETRY_AFTER
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_fetch_api_data_resumes_from_checkpoint(tmdb_api, tmp_path, max_workers: int):
+    checkpoint_store = CheckpointStore(f'{tmp_path}/checkpoints')
+    params = {'sort_by': 'primary_release_date.asc'}
+    with pytest.raises(Exception, match='Failed to fetch data from TMDB API'):
+        tmdb_api(max_workers, FakeSession(failing_pages={3}), checkpoint_store).fetch_api_data('discover/movie', 0, dict(params))
+
+    session = FakeSession()
+    data = tmdb_api(max_workers, session, checkpoint_store).fetch_api_data('discover/movie', 0, dict(params))
+
+    assert [row['id'] for row in data] == expected_ids()
+    assert 3 in session.requested_pages
+    assert not {1, 2} & set(session.requested_pages)
+
+
+def test_clear_checkpoint_forgets_fetched_pages(tmdb_api, tmp_path):
+    checkpoint_store = CheckpointStore(f'{tmp_path}/checkpoints')
+    tmdb_api(1, FakeSession(), checkpoint_store).fetch_api_data('discover/movie', 0, {})
+
+    api = tmdb_api(1, FakeSession(), checkpoint_store)
+    api.clear_checkpoint('discover/movie')
+    api.fetch_api_data('discover/movie', 0, {})
+
+    assert sorted(api.session.requested_pages) == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_iter_sharded_pages_splits_windows_past_page_cap(tmdb_api, monkeypatch, max_workers: int):
+    monkeypatch.setattr(themoviedb, 'MAX_DISCOVER_PAGES', 2)
+    monkeypatch.setattr(themoviedb, 'DISCOVER_PAGE_SIZE', 5)
+    start = date(2024, 1, 1)
+    movies = [{'id': i, 'release_dates': [str(start + timedelta(days=i % 60))]} for i in range(200)]
+    movies.append({'id': 1000, 'release_dates': [str(start), str(start + timedelta(days=59))]})
+    api = tmdb_api(max_workers, DatedFakeSession(movies))
+
+    pages = api.iter_sharded_pages('discover/movie', {}, MOVIES_DATE_PARAMS, start, start + timedelta(days=59))
+    ids = [row['id'] for page in pages for row in page]
+
+    assert sorted(ids) == sorted(m['id'] for m in movies)
+
+
+def test_iter_movies_sharded_ignores_max_pages(tmdb_api, monkeypatch):
+    monkeypatch.setattr(themoviedb, 'DISCOVER_PAGE_SIZE', 5)
+    start = date(2024, 1, 1)
+    monkeypatch.setattr(themoviedb, '_today', lambda: start + timedelta(days=9))
+    movies = [{'id': i, 'release_dates': [str(start + timedelta(days=i % 10))]} for i in range(30)]
+    api = tmdb_api(1, DatedFakeSession(movies))
+
+    pages = api.iter_movies(datetime(2024, 1, 1, tzinfo=UTC), max_pages=1, sharded=True)
+
+    assert sorted(row['id'] for page in pages for row in page) == list(range(30))
+
+
+def test_fetch_api_data_serves_repeated_pages_from_response_cache(tmdb_api, tmp_path):
+    now = [0.0]
+    response_cache = ResponseCache(f'{tmp_path}/cache', ttl_seconds=60, clock=lambda: now[0])
+    tmdb_api(1, FakeSession(), response_cache=response_cache).fetch_api_data('discover/movie', 0, {})
+
+    session = FakeSession()
+    data = tmdb_api(1, session, response_cache=response_cache).fetch_api_data('discover/movie', 0, {})
+    assert [row['id'] for row in data] == expected_ids()
+    assert session.requested_pages == []
+
+    now[0] = 120.0
+    data = tmdb_api(1, session, response_cache=response_cache).fetch_api_data('discover/movie', 0, {})
+    assert [row['id'] for row in data] == expected_ids()
+    assert session.requested_pages == [1, 2, 3, 4, 5]
+    assert response_cache.stats() | {'size_bytes': 0} == {'hits': 5, 'revalidated': 5, 'misses': 5, 'size_bytes': 0}
@@ -1,5 +1,8 @@
+from datetime import UTC, datetime
 from decimal import Decimal
 
+import polars as pl
+import pytest
 import sqlalchemy as sa
 
 from google_sheet.uploader import JobConfig, UploadGoogleSheetJob
@@ -99,3 +102,36 @@ def create_data_table(duckdb_connection: DuckDBConnection, data, table_name: str
         )
         metadata.create_all(engine)
         engine.execute(source.insert(), data)
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.reads: list[tuple[str, str | None, int]] = []
+
+    def read_arrow(self, query: str, partition_on: str | None = None, partitions: int = 1) -> pl.DataFrame:
+        self.reads.append((query, partition_on, partitions))
+        return pl.DataFrame()
+
+
+@pytest.mark.parametrize(
+    ('limit', 'query', 'partitions'), [(1000, 'select id from movies limit 1000', 1), (None, 'select id from movies', 4)]
+)
+def test_upload_google_sheet_job_only_partitions_unlimited_reads(limit: int | None, query: str, partitions: int):
+    connection = RecordingConnection()
+    config = JobConfig(
+        table_name='movies',
+        bookmark=datetime(2024, 1, 1, tzinfo=UTC),
+        sheet_url=SHEET_URL,
+        worksheet_name=WORKSHEET_NAME,
+        columns=['id'],
+        limit=limit,
+        db_uri='postgresql://etl@localhost/etl',
+        gs_secret_name='google-sheet',
+        partition_on='id',
+        read_partitions=4,
+    )
+    uploader = UploadGoogleSheetJob(FakeGoogleSheet(), connection, config, InMemoryBookmarkUpdater().update)
+
+    uploader._fetch_data(uploader._compose_query())
+
+    assert connection.reads == [(query, 'id', partitions)]
@@ -0,0 +1,99 @@
+import polars as pl
+import sqlalchemy as sa
+
+from util.connection_factory import ConnectionFactory, EngineRegistry, TimedQueuePool, read_arrow, stream_batches
+
+
+def test_duckdb_connections_share_registered_engine(tmp_path):
+    first = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+    second = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+
+    with first.get_sqlalchemy_engine() as engine, second.get_sqlalchemy_engine() as other_engine:
+        assert engine is other_engine
+        assert isinstance(engine.pool, TimedQueuePool)
+
+
+def test_engine_registry_creates_engine_per_pool_options(tmp_path):
+    registry = EngineRegistry()
+    url = f'sqlite:///{tmp_path}/db.sqlite'
+
+    small = registry.get(url, pool_size=2, max_overflow=0)
+    large = registry.get(url, pool_size=8, max_overflow=4)
+
+    assert registry.get(url, max_overflow=0, pool_size=2) is small
+    assert large is not small
+    assert (small.pool.size(), large.pool.size()) == (2, 8)
+    assert sorted(registry.metrics()) == [f'{url} (max_overflow=0, pool_size=2)', f'{url} (max_overflow=4, pool_size=8)']
+    registry.dispose_all()
+
+
+def test_engine_registry_reports_pool_metrics(tmp_path):
+    registry = EngineRegistry()
+    url = f'sqlite:///{tmp_path}/db.sqlite'
+    engine = registry.get(url, pool_size=2)
+
+    with engine.connect() as conn, engine.connect() as other_conn:
+        conn.execute(sa.text('SELECT 1'))
+        other_conn.execute(sa.text('SELECT 1'))
+        metrics = registry.metrics()[f'{url} (pool_size=2)']
+        assert metrics['checked_out'] == 2
+
+    assert metrics['checkouts'] == 2
+    assert metrics['pool_size'] == 2
+    assert metrics['wait_seconds'] >= metrics['max_wait_seconds'] >= 0
+    registry.dispose_all()
+    assert registry.metrics() == {}
+
+
+def test_read_arrow_returns_query_result(tmp_path):
+    connection = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+    with connection.get_sqlalchemy_engine() as engine, engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE movies AS SELECT range AS id, 'movie ' || range AS title FROM range(3)"))
+
+    df = connection.read_arrow('SELECT id, title FROM movies WHERE id > 0 ORDER BY id', partition_on='id', partitions=2)
+
+    assert df.to_dicts() == [{'id': 1, 'title': 'movie 1'}, {'id': 2, 'title': 'movie 2'}]
+
+
+def test_read_arrow_falls_back_for_other_databases(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/db.sqlite')
+    with engine.begin() as conn:
+        conn.execute(sa.text("CREATE TABLE movies AS SELECT 1 AS id, 'a' AS title"))
+
+    df = read_arrow(engine, 'SELECT id, title FROM movies')
+
+    assert df.equals(pl.DataFrame({'id': [1], 'title': ['a']}))
+
+
+def test_duckdb_native_connection_shares_engine_database(tmp_path):
+    connection = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+    with connection.get_duckdb_connection() as conn:
+        conn.register('source', pl.DataFrame({'id': [1, 2]}))
+        conn.execute('CREATE TABLE movies AS SELECT * FROM source')
+
+    with connection.get_sqlalchemy_engine() as engine, engine.connect() as conn:
+        assert conn.execute(sa.text('SELECT SUM(id) FROM movies')).scalar() == 3
+
+
+def test_stream_batches_yields_fetch_size_batches_from_duckdb(tmp_path):
+    connection = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+
+    batches = list(connection.stream_batches('SELECT range AS id FROM range(5)', fetch_size=2))
+
+    assert [batch['id'].to_list() for batch in batches] == [[0, 1], [2, 3], [4]]
+
+
+def test_stream_batches_fetches_rows_in_batches_from_other_databases(tmp_path):
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/db.sqlite')
+    with engine.begin() as conn:
+        conn.execute(sa.text('CREATE TABLE movies (id INTEGER, title TEXT)'))
+        conn.execute(sa.text("INSERT INTO movies VALUES (1, 'a'), (2, NULL), (3, 'c')"))
+
+    batches = list(stream_batches(engine, 'SELECT id, title FROM movies ORDER BY id', fetch_size=2))
+
+    assert [batch.height for batch in batches] == [2, 1]
+    assert pl.concat(batches).to_dicts() == [
+        {'id': 1, 'title': 'a'},
+        {'id': 2, 'title': None},
+        {'id': 3, 'title': 'c'},
+    ]
@@ -0,0 +1,40 @@
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from util.dump_writer import DumpWriterFactory
+from util.file_system import DataFrameFormat
+
+pages = [
+    pl.DataFrame({'id': [1, 2], 'title': [None, None]}),
+    pl.DataFrame({'id': [3], 'title': ['c']}),
+    pl.DataFrame({'id': [4, 5], 'title': ['d', None]}),
+]
+expected_df = pl.DataFrame({'id': [1, 2, 3, 4, 5], 'title': [None, None, 'c', 'd', None]})
+
+
+def test_parquet_dump_writer_appends_pages_in_row_groups(tmp_path):
+    dump_path = f'{tmp_path}/dump'
+
+    with DumpWriterFactory.from_format(DataFrameFormat.PARQUET, dump_path, row_group_size=3) as writer:
+        for page in pages:
+            writer.write(page)
+
+    assert writer.rows == 5
+    assert_frame_equal(pl.read_parquet(f'{dump_path}/*.parquet'), expected_df)
+
+
+def test_csv_dump_writer_appends_pages(tmp_path):
+    dump_path = f'{tmp_path}/dump.csv'
+
+    with DumpWriterFactory.from_format(DataFrameFormat.CSV, dump_path) as writer:
+        for page in pages:
+            writer.write(page.select('title', 'id'))
+
+    assert writer.rows == 5
+    assert_frame_equal(pl.read_csv(dump_path, separator='|').select('id', 'title'), expected_df)
+
+
+def test_dump_writer_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match='Unsupported dump format'):
+        DumpWriterFactory.from_format('json', f'{tmp_path}/dump')
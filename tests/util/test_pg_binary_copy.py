@@ -0,0 +1,101 @@
+import struct
+from datetime import UTC, date, datetime
+
+import polars as pl
+
+from util.pg_binary_copy import HEADER, NULL, TRAILER, BinaryCopyStream, copy_binary, encode_rows, postgres_column_types
+
+
+class FakeCursor:
+    def __init__(self):
+        self.payload = b''
+
+    def __enter__(self) -> 'FakeCursor':
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        pass
+
+    def copy_expert(self, sql: str, file, size: int) -> None:
+        self.sql = sql
+        while chunk := file.read(size):
+            self.payload += chunk
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cursor_ = FakeCursor()
+
+    def cursor(self) -> FakeCursor:
+        return self.cursor_
+
+
+def test_encode_rows_uses_destination_column_types():
+    df = pl.DataFrame(
+        {'id': [1], 'title': ['é'], 'release_date': [date(2000, 1, 2)], 'score': [None]},
+        schema_overrides={'score': pl.Float64},
+    )
+
+    payload = encode_rows(df, {'id': 'INTEGER', 'title': 'VARCHAR(10)', 'release_date': 'DATE', 'score': 'DOUBLE PRECISION'})
+
+    assert payload == (
+        struct.pack('>h', 4) + struct.pack('>ii', 4, 1) + struct.pack('>i', 2) + 'é'.encode() + struct.pack('>ii', 4, 1) + NULL
+    )
+
+
+def test_encode_rows_interleaves_columns_with_nulls_and_empty_text():
+    df = pl.DataFrame(
+        {'id': [1, None, 3], 'title': ['', None, 'ab'], 'adult': [True, False, None]},
+        schema={'id': pl.Int64, 'title': pl.Utf8, 'adult': pl.Boolean},
+    )
+
+    payload = encode_rows(df, {'id': 'BIGINT', 'title': 'TEXT', 'adult': 'BOOLEAN'})
+
+    rows = [
+        [struct.pack('>iq', 8, 1), struct.pack('>i', 0), struct.pack('>i?', 1, True)],
+        [NULL, NULL, struct.pack('>i?', 1, False)],
+        [struct.pack('>iq', 8, 3), struct.pack('>i', 2) + b'ab', NULL],
+    ]
+    assert payload == b''.join(struct.pack('>h', 3) + b''.join(fields) for fields in rows)
+
+
+def test_encode_rows_counts_timestamps_from_postgres_epoch():
+    df = pl.DataFrame({'loaded_at': [datetime(2000, 1, 1, 0, 0, 1, tzinfo=UTC)]})
+
+    payload = encode_rows(df, {'loaded_at': 'TIMESTAMP WITH TIME ZONE'})
+
+    assert payload == struct.pack('>h', 1) + struct.pack('>iq', 8, 1_000_000)
+
+
+def test_copy_binary_streams_all_batches():
+    connection = FakeConnection()
+    batches = [pl.DataFrame({'id': [1, 2]}), pl.DataFrame({'id': [3]})]
+
+    stats = copy_binary(connection, 'etl.movies_temp', {'id': 'BIGINT'}, batches)
+
+    row = struct.pack('>h', 1) + struct.pack('>i', 8)
+    assert connection.cursor_.sql == 'COPY etl.movies_temp ("id") FROM STDIN WITH (FORMAT binary)'
+    assert connection.cursor_.payload == HEADER + b''.join(row + struct.pack('>q', i) for i in [1, 2, 3]) + TRAILER
+    assert (stats.rows, stats.bytes) == (3, len(connection.cursor_.payload))
+
+
+def test_binary_copy_stream_honours_read_size():
+    stream = BinaryCopyStream([pl.DataFrame({'id': [1]})], {'id': 'BIGINT'})
+
+    chunks = iter(lambda: stream.read(5), b'')
+
+    assert all(len(chunk) <= 5 for chunk in chunks)
+
+
+def test_postgres_column_types_maps_dump_schema():
+    schema = pl.Schema(
+        {'id': pl.Int64, 'title': pl.Utf8, 'released': pl.Date, 'loaded_at': pl.Datetime('us', 'UTC'), 'tags': pl.List(pl.Utf8)}
+    )
+
+    assert postgres_column_types(schema) == {
+        'id': 'BIGINT',
+        'title': 'TEXT',
+        'released': 'DATE',
+        'loaded_at': 'TIMESTAMP WITH TIME ZONE',
+        'tags': 'TEXT',
+    }
@@ -0,0 +1,356 @@
+from datetime import UTC, date, datetime
+
+import polars as pl
+import pyarrow.parquet as pq
+import pytest
+import sqlalchemy as sa
+
+from util import table_copier
+from util.connection_factory import ConnectionFactory
+from util.metadata import LoadType
+from util.table_copier import (
+    DuckDBTableIngestor,
+    MergeCounts,
+    PostgresTableIngestor,
+    SchemaCache,
+    TableIngestor,
+    TableIngestorFactory,
+    _shard_row_groups,
+)
+
+TABLE = 'etl.movies'
+LOAD_TIMESTAMP = datetime(2024, 3, 1, tzinfo=UTC)
+PRIMARY_KEY_QUERY = (
+    "SELECT constraint_column_names FROM duckdb_constraints() WHERE table_name = 'movies' AND constraint_type = 'PRIMARY KEY'"
+)
+INDEX_QUERY = "SELECT index_name, is_unique FROM duckdb_indexes() WHERE table_name = 'movies' ORDER BY index_name"
+
+
+@pytest.fixture
+def duckdb(tmp_path):
+    connection = ConnectionFactory.from_uri(f'duckdb://{tmp_path}/db.duckdb')
+    with connection.get_sqlalchemy_engine() as engine:
+        with engine.begin() as conn:
+            conn.execute(sa.text('CREATE SCHEMA etl'))
+        yield connection, engine
+
+
+def ingest(duckdb, tmp_path, df: pl.DataFrame, **options) -> TableIngestor:
+    connection, engine = duckdb
+    dump_path = tmp_path / 'dump'
+    dump_path.mkdir(exist_ok=True)
+    df.write_parquet(dump_path / 'part-0.parquet')
+    ingestor = TableIngestorFactory.from_connection_type(
+        conn_type=connection.type,
+        engine=engine,
+        table=TABLE,
+        load_timestamp=options.pop('load_timestamp', LOAD_TIMESTAMP),
+        primary_keys=['id'],
+        range_column='updated_at',
+        **options,
+    )
+    ingestor.execute(str(dump_path))
+    return ingestor
+
+
+def read_table(engine, query: str = f'SELECT id, title, load_timestamp FROM {TABLE} ORDER BY id') -> list[tuple]:
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(sa.text(query))]
+
+
+def test_duckdb_upsert_keeps_latest_row_per_key(duckdb, tmp_path):
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1, 2], 'title': ['a', 'b'], 'updated_at': [1, 1]}))
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [2, 2, 3], 'title': ['b-old', 'b-new', 'c'], 'updated_at': [2, 3, 1]}))
+
+    _, engine = duckdb
+    load_timestamp = LOAD_TIMESTAMP.replace(tzinfo=None)
+    assert read_table(engine) == [(1, 'a', load_timestamp), (2, 'b-new', load_timestamp), (3, 'c', load_timestamp)]
+    assert read_table(engine, INDEX_QUERY) == [('movies_key_idx', True)]
+
+
+def test_duckdb_reload_with_range_index_updates_range_column_and_row_hash(duckdb, tmp_path):
+    _, engine = duckdb
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]}), index_range_column=True, detect_changes=True)
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a3'], 'updated_at': [3]}), index_range_column=True, detect_changes=True)
+
+    assert read_table(engine, f'SELECT id, title, updated_at FROM {TABLE}') == [(1, 'a3', 3)]
+    stored, expected = read_table(engine, f"SELECT row_hash, md5('1:1' || '2:a3' || '1:3') FROM {TABLE}")[0]
+    assert stored == expected
+
+
+def test_duckdb_upsert_falls_back_when_table_has_other_indexes(duckdb, tmp_path):
+    _, engine = duckdb
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]}))
+    with engine.begin() as conn:
+        conn.execute(sa.text(f'CREATE INDEX movies_title_idx ON {TABLE} (title)'))
+    # The index is created outside the ingestor, which therefore has to be told the schema changed
+    table_copier.schema_cache.invalidate(engine, TABLE)
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1, 2], 'title': ['a-new', 'b'], 'updated_at': [2, 1]}))
+
+    assert read_table(engine, f'SELECT id, title, updated_at FROM {TABLE} ORDER BY id') == [(1, 'a-new', 2), (2, 'b', 1)]
+
+
+@pytest.mark.parametrize('first_load_has_null_keys', [True, False])
+def test_duckdb_dump_with_null_keys_falls_back_to_temp_table_merge(duckdb, tmp_path, first_load_has_null_keys: bool):
+    null_key_dump = pl.DataFrame({'id': [None, 1], 'title': ['n', 'a'], 'updated_at': [1, 1]}, schema_overrides={'id': pl.Int64})
+    first = null_key_dump if first_load_has_null_keys else pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]})
+    ingest(duckdb, tmp_path, first)
+
+    df = pl.DataFrame({'id': [None, 2], 'title': ['n-new', 'b'], 'updated_at': [2, 1]}, schema_overrides={'id': pl.Int64})
+    ingest(duckdb, tmp_path, df)
+
+    _, engine = duckdb
+    rows = read_table(engine, f'SELECT id, title FROM {TABLE} ORDER BY id NULLS FIRST')
+    assert rows == [(None, 'n-new'), (1, 'a'), (2, 'b')]
+    assert read_table(engine, PRIMARY_KEY_QUERY) == []
+
+
+@pytest.mark.parametrize(
+    ('id_type', 'primary_key', 'indexes'),
+    [('BIGINT NOT NULL', [(['id'],)], []), ('BIGINT', [], [('movies_key_idx', True)])],
+    ids=['not_null', 'nullable'],
+)
+def test_duckdb_ingest_without_primary_key_uses_temp_table_merge(duckdb, tmp_path, id_type: str, primary_key: list, indexes: list):
+    _, engine = duckdb
+    with engine.begin() as conn:
+        conn.execute(sa.text(f'CREATE TABLE {TABLE} (id {id_type}, title VARCHAR, updated_at BIGINT, load_timestamp TIMESTAMP)'))
+        conn.execute(sa.text(f"INSERT INTO {TABLE} VALUES (1, 'a', 1, NULL)"))
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1, 1, 2], 'title': ['a-old', 'a-new', 'b'], 'updated_at': [2, 3, 1]}))
+
+    assert [row[:2] for row in read_table(engine)] == [(1, 'a-new'), (2, 'b')]
+    assert read_table(engine, PRIMARY_KEY_QUERY) == primary_key
+    assert read_table(engine, INDEX_QUERY) == indexes
+
+
+def test_duckdb_merge_into_indexed_table_accepts_null_keys_later(duckdb, tmp_path):
+    _, engine = duckdb
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]}), merge_batch_size=10)
+    df = pl.DataFrame({'id': [None, 1], 'title': ['n', 'a-new'], 'updated_at': [1, 2]}, schema_overrides={'id': pl.Int64})
+
+    ingest(duckdb, tmp_path, df, merge_batch_size=10)
+
+    assert read_table(engine, f'SELECT id, title FROM {TABLE} ORDER BY id NULLS FIRST') == [(None, 'n'), (1, 'a-new')]
+    assert read_table(engine, INDEX_QUERY) == [('movies_key_idx', True)]
+
+
+def test_duckdb_temp_table_merge_replaces_rows_with_null_keys(duckdb, tmp_path):
+    _, engine = duckdb
+    with engine.begin() as conn:
+        conn.execute(sa.text(f"CREATE TABLE {TABLE} AS SELECT NULL::BIGINT AS id, 'a' AS title, 1 AS updated_at, NULL::TIMESTAMP AS ts"))
+    df = pl.DataFrame({'id': [None, 1], 'title': ['a-new', 'b'], 'updated_at': [2, 1]}, schema_overrides={'id': pl.Int64})
+
+    ingest(duckdb, tmp_path, df)
+
+    assert read_table(engine, f'SELECT id, title FROM {TABLE} ORDER BY id NULLS FIRST') == [(None, 'a-new'), (1, 'b')]
+
+
+def test_duckdb_key_index_falls_back_for_tables_with_duplicate_keys(duckdb, tmp_path):
+    _, engine = duckdb
+    with engine.begin() as conn:
+        conn.execute(sa.text(f"CREATE TABLE {TABLE} AS SELECT * FROM (VALUES (1, 'a', 1), (1, 'a', 1)) AS v(id, title, updated_at)"))
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [2], 'title': ['b'], 'updated_at': [1]}), index_range_column=True)
+
+    assert read_table(engine, PRIMARY_KEY_QUERY) == []
+    assert read_table(engine, INDEX_QUERY) == [('movies_key_idx', False), ('movies_updated_at_idx', False)]
+    assert [row[:2] for row in read_table(engine)] == [(1, 'a'), (1, 'a'), (2, 'b')]
+
+
+@pytest.mark.parametrize('primary_key', [True, False])
+def test_duckdb_ingest_stamps_load_timestamp_and_batch_id(duckdb, tmp_path, primary_key: bool):
+    _, engine = duckdb
+    if not primary_key:
+        with engine.begin() as conn:
+            conn.execute(sa.text(f'CREATE TABLE {TABLE} (id BIGINT, title VARCHAR, updated_at BIGINT, load_timestamp TIMESTAMP)'))
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]}), batch_id="run-'1'")
+
+    load_timestamp = LOAD_TIMESTAMP.replace(tzinfo=None)
+    assert read_table(engine, f'SELECT id, load_timestamp, batch_id FROM {TABLE}') == [(1, load_timestamp, "run-'1'")]
+
+
+def test_duckdb_chunked_merge_resumes_after_last_committed_chunk(duckdb, tmp_path, monkeypatch):
+    _, engine = duckdb
+    df = pl.DataFrame(
+        {'id': [1, 2, 2, 3, 4, 5, None], 'title': ['a', 'b-old', 'b', 'c', 'd', 'e', 'n'], 'updated_at': [1, 1, 2, 1, 1, 1, 1]}
+    )
+    merged_chunks = []
+    create_delete_query = TableIngestor.create_delete_query
+
+    def failing_delete_query(self, condition: str = 'TRUE') -> str:
+        if len(merged_chunks) == 1:
+            raise RuntimeError('lost connection')
+        merged_chunks.append(condition)
+        return create_delete_query(self, condition)
+
+    monkeypatch.setattr(TableIngestor, 'create_delete_query', failing_delete_query)
+    with pytest.raises(RuntimeError):
+        ingest(duckdb, tmp_path, df, merge_batch_size=2)
+    assert [row[:2] for row in read_table(engine)] == [(1, 'a'), (2, 'b')]
+
+    merged_chunks.append('resumed')
+    ingest(duckdb, tmp_path, df, merge_batch_size=2)
+
+    assert len(merged_chunks) == 4
+    assert [row[:2] for row in read_table(engine, f'SELECT id, title FROM {TABLE} ORDER BY id NULLS FIRST')] == [
+        (None, 'n'),
+        (1, 'a'),
+        (2, 'b'),
+        (3, 'c'),
+        (4, 'd'),
+        (5, 'e'),
+    ]
+    assert read_table(engine, 'SELECT * FROM etl.table_ingestor_progress') == []
+
+
+@pytest.mark.parametrize(
+    ('create_table', 'options'),
+    [(False, {}), (True, {}), (True, {'merge_batch_size': 1})],
+    ids=['upsert', 'temp_table', 'chunked'],
+)
+def test_duckdb_change_detection_only_rewrites_new_and_changed_rows(duckdb, tmp_path, create_table: bool, options: dict):
+    _, engine = duckdb
+    if create_table:
+        with engine.begin() as conn:
+            conn.execute(
+                sa.text(f'CREATE TABLE {TABLE} (id BIGINT, title VARCHAR, note VARCHAR, updated_at BIGINT, load_timestamp TIMESTAMP)')
+            )
+    df = pl.DataFrame({'id': [1, 2, 4, 5], 'title': ['a', None, 'a|b', 'e'], 'note': [None, None, 'c', None], 'updated_at': [1, 1, 1, 1]})
+    first = ingest(duckdb, tmp_path, df, detect_changes=True, **options)
+    assert first.merge_counts == MergeCounts(inserted=4)
+
+    # Rows 4 and 5 only differ in where a '|' splits the values and in NULL versus a literal '\N'
+    reloaded_at = datetime(2024, 3, 2, tzinfo=UTC)
+    df = pl.DataFrame(
+        {
+            'id': [1, 1, 2, 3, 4, 5],
+            'title': ['a-old', 'a', 'b', 'c', 'a', 'e'],
+            'note': [None, None, None, None, 'b|c', '\\N'],
+            'updated_at': [0, 1, 1, 1, 1, 1],
+        }
+    )
+    second = ingest(duckdb, tmp_path, df, detect_changes=True, load_timestamp=reloaded_at, **options)
+
+    assert second.merge_counts == MergeCounts(inserted=1, updated=3, unchanged=1)
+    assert read_table(engine, f'SELECT id, title, note, load_timestamp FROM {TABLE} ORDER BY id') == [
+        (1, 'a', None, LOAD_TIMESTAMP.replace(tzinfo=None)),
+        (2, 'b', None, reloaded_at.replace(tzinfo=None)),
+        (3, 'c', None, reloaded_at.replace(tzinfo=None)),
+        (4, 'a', 'b|c', reloaded_at.replace(tzinfo=None)),
+        (5, 'e', '\\N', reloaded_at.replace(tzinfo=None)),
+    ]
+
+
+@pytest.mark.parametrize('options', [{}, {'merge_batch_size': 1}], ids=['temp_table', 'chunked'])
+def test_duckdb_change_detection_matches_null_keys(duckdb, tmp_path, options: dict):
+    _, engine = duckdb
+    schema = {'id': pl.Int64, 'title': pl.String, 'updated_at': pl.Int64}
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [None, 1], 'title': ['n', 'a'], 'updated_at': [1, 1]}, schema=schema), detect_changes=True)
+
+    reloaded_at = datetime(2024, 3, 2, tzinfo=UTC)
+    df = pl.DataFrame({'id': [None, 1, 2], 'title': ['n', 'a-new', 'b'], 'updated_at': [1, 1, 1]}, schema=schema)
+    second = ingest(duckdb, tmp_path, df, detect_changes=True, load_timestamp=reloaded_at, **options)
+
+    assert second.merge_counts == MergeCounts(inserted=1, updated=1, unchanged=1)
+    assert read_table(engine, f'SELECT id, title, load_timestamp FROM {TABLE} ORDER BY id NULLS FIRST') == [
+        (None, 'n', LOAD_TIMESTAMP.replace(tzinfo=None)),
+        (1, 'a-new', reloaded_at.replace(tzinfo=None)),
+        (2, 'b', reloaded_at.replace(tzinfo=None)),
+    ]
+
+
+@pytest.mark.parametrize('existing_table', [True, False])
+def test_duckdb_full_refresh_swaps_in_new_table(duckdb, tmp_path, existing_table: bool):
+    _, engine = duckdb
+    if existing_table:
+        ingest(duckdb, tmp_path, pl.DataFrame({'id': [1, 2], 'title': ['a', 'b'], 'updated_at': [1, 1]}), index_range_column=True)
+    df = pl.DataFrame({'id': [2, 2, 3], 'title': ['b-old', 'b', 'c'], 'updated_at': [1, 2, 1]})
+
+    ingest(duckdb, tmp_path, df, load_type=LoadType.FULL_REFRESH, index_range_column=True)
+
+    assert [row[:2] for row in read_table(engine)] == [(2, 'b'), (3, 'c')]
+    assert read_table(engine, PRIMARY_KEY_QUERY) == []
+    assert read_table(engine, INDEX_QUERY) == [('movies_key_idx', True), ('movies_updated_at_idx', False)]
+    assert read_table(engine, "SELECT table_name FROM duckdb_tables() WHERE schema_name = 'etl'") == [('movies',)]
+
+
+def test_postgres_full_refresh_renames_new_table_indexes_during_swap():
+    engine = sa.create_engine('postgresql://etl@localhost/etl')
+    ingestor = PostgresTableIngestor(engine, TABLE, LOAD_TIMESTAMP, ['id'], 'updated_at', index_range_column=True)
+
+    assert ingestor._swap_statements(f'{TABLE}_new') == [
+        f'DROP TABLE IF EXISTS {TABLE}',
+        f'ALTER TABLE {TABLE}_new RENAME TO "movies"',
+        'ALTER INDEX etl.movies_new_key_idx RENAME TO movies_key_idx',
+        'ALTER INDEX etl.movies_new_updated_at_idx RENAME TO movies_updated_at_idx',
+    ]
+
+
+def test_shard_row_groups_deals_row_groups_round_robin(tmp_path):
+    paths = []
+    for i, rows in enumerate([5, 2]):
+        paths.append(str(tmp_path / f'part-{i}.parquet'))
+        pq.write_table(pl.DataFrame({'id': range(rows)}).to_arrow(), paths[-1], row_group_size=2)
+
+    assert _shard_row_groups(paths, 2) == [{paths[0]: [0, 2]}, {paths[0]: [1], paths[1]: [0]}]
+    assert _shard_row_groups(paths, 8) == [{paths[0]: [0]}, {paths[0]: [1]}, {paths[0]: [2]}, {paths[1]: [0]}]
+
+
+def test_schema_cache_reflects_table_once_until_invalidated(duckdb, monkeypatch):
+    _, engine = duckdb
+    reflections = []
+    monkeypatch.setattr(table_copier, 'inspect', lambda engine: reflections.append(engine) or sa.inspect(engine))
+    cache = SchemaCache()
+
+    assert cache.get_columns(engine, TABLE) == []
+    with engine.begin() as conn:
+        conn.execute(sa.text(f'CREATE TABLE {TABLE} (id BIGINT)'))
+    assert cache.get_columns(engine, TABLE) == []
+    cache.invalidate(engine, TABLE)
+
+    assert [col['name'] for col in cache.get_columns(engine, TABLE)] == ['id']
+    assert [col['name'] for col in cache.get_columns(engine, TABLE)] == ['id']
+    assert len(reflections) == 2
+
+
+def test_duckdb_ingest_reflects_indexes_only_after_index_ddl(duckdb, tmp_path, monkeypatch):
+    reflections = []
+    reflect_indexes = DuckDBTableIngestor._reflect_indexes
+    monkeypatch.setattr(DuckDBTableIngestor, '_reflect_indexes', lambda self: reflections.append(self.table) or reflect_indexes(self))
+    df = pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]})
+
+    ingest(duckdb, tmp_path, df, index_range_column=True)
+    reflections.clear()
+    ingest(duckdb, tmp_path, df, index_range_column=True)
+    ingest(duckdb, tmp_path, df, index_range_column=True)
+
+    # The first load's index DDL invalidated the cache, so only the load right after it reads the catalog
+    assert reflections == [TABLE]
+
+
+@pytest.mark.parametrize('create_table', [False, True], ids=['upsert', 'temp_table'])
+def test_duckdb_ingest_adds_columns_when_dump_schema_drifts(duckdb, tmp_path, create_table: bool):
+    _, engine = duckdb
+    if create_table:
+        with engine.begin() as conn:
+            conn.execute(sa.text(f'CREATE TABLE {TABLE} (id BIGINT, title VARCHAR, updated_at BIGINT, load_timestamp TIMESTAMP)'))
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [1], 'title': ['a'], 'updated_at': [1]}))
+
+    ingest(duckdb, tmp_path, pl.DataFrame({'id': [2], 'title': ['b'], 'updated_at': [1], 'rating': [7.5]}))
+
+    assert read_table(engine, f'SELECT id, title, rating FROM {TABLE} ORDER BY id') == [(1, 'a', None), (2, 'b', 7.5)]
+
+
+def test_duckdb_create_temp_table_keeps_dataframe_types(duckdb):
+    connection, engine = duckdb
+    ingestor = TableIngestorFactory.from_connection_type(connection.type, engine, TABLE, LOAD_TIMESTAMP, ['id'], 'updated_at')
+    df = pl.DataFrame({'id': [1], 'title': ['a'], 'released': [date(2024, 1, 1)]})
+
+    ingestor.create_temp_table(df)
+
+    query = f'SELECT column_name, data_type FROM information_schema.columns WHERE table_name = {ingestor.temp_table.split(".")[1]!r}'
+    assert read_table(engine, query) == [('id', 'BIGINT'), ('title', 'VARCHAR'), ('released', 'DATE')]
+    assert read_table(engine, f'SELECT * FROM {ingestor.temp_table}') == [(1, 'a', date(2024, 1, 1))]